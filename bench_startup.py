@@ -0,0 +1,67 @@
+"""
+Mede o tempo de inicialização a frio: cada medição roda em um processo novo,
+importando o módulo alvo. Com --detalhar, lista os módulos mais caros
+segundo `python -X importtime`.
+
+Uso: python bench_startup.py [mainC main ...] [--repeticoes 5] [--detalhar 15]
+"""
+import sys
+import argparse
+import statistics
+import subprocess
+
+CODIGO = "import time; t = time.perf_counter(); import {modulo}; print(time.perf_counter() - t)"
+
+
+def medir(modulo, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        resultado = subprocess.run(
+            [sys.executable, '-c', CODIGO.format(modulo=modulo)],
+            capture_output=True, text=True
+        )
+        if resultado.returncode != 0:
+            raise RuntimeError(resultado.stderr.strip().splitlines()[-1])
+        tempos.append(float(resultado.stdout.strip().splitlines()[-1]))
+    return tempos
+
+
+def detalhar(modulo, limite):
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {modulo}"],
+        capture_output=True, text=True
+    )
+    linhas = []
+    for linha in resultado.stderr.splitlines():
+        # Formato: "import time: self [us] | cumulative | imported package"
+        partes = linha.split('|')
+        if len(partes) != 3 or not partes[1].strip().isdigit():
+            continue
+        linhas.append((int(partes[1]), partes[2].rstrip()))
+    return sorted(linhas, reverse=True)[:limite]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de importação a frio")
+    parser.add_argument('modulos', nargs='*', default=['mainC', 'main'])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--detalhar', type=int, default=0, metavar='N',
+                        help="mostra os N módulos com maior tempo acumulado")
+    args = parser.parse_args(argv)
+
+    for modulo in args.modulos:
+        try:
+            tempos = medir(modulo, args.repeticoes)
+        except RuntimeError as e:
+            print(f"{modulo}: falhou ({e})")
+            continue
+        print(
+            f"{modulo}: mediana {statistics.median(tempos) * 1000:.1f} ms, "
+            f"mínimo {min(tempos) * 1000:.1f} ms ({args.repeticoes} execuções)"
+        )
+        for acumulado, nome in detalhar(modulo, args.detalhar):
+            print(f"    {acumulado / 1000:8.1f} ms {nome}")
+
+
+if __name__ == '__main__':
+    main()
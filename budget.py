@@ -0,0 +1,131 @@
+import math
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+BUDGET_DB = 'fipe_budget.db'
+logger = logging.getLogger(__name__)
+
+
+class RequestBudget:
+    """
+    Contabilidade persistente das requisições enviadas à FIPE, por endpoint,
+    tabela de referência, dia e hora, com teto diário e horário opcionais.
+
+    Cada requisição é reservada antes do envio dentro de uma transação, então
+    processos paralelos (shards) que usam o mesmo banco dividem o mesmo teto.
+    """
+    def __init__(self, path=BUDGET_DB, diario=None, horario=None):
+        self.path = path
+        self.diario = diario
+        self.horario = horario
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get('request_budget_db', BUDGET_DB),
+            diario=config.get('request_budget_daily'),
+            horario=config.get('request_budget_hourly')
+        )
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS requisicoes ('
+                ' dia TEXT NOT NULL,'
+                ' hora INTEGER NOT NULL,'
+                ' endpoint TEXT NOT NULL,'
+                ' tabela_id INTEGER NOT NULL,'
+                ' total INTEGER NOT NULL,'
+                ' PRIMARY KEY (dia, hora, endpoint, tabela_id)'
+                ') WITHOUT ROWID'
+            )
+        return self._conn
+
+    def _used(self, conn, dia, hora):
+        usado_dia, usado_hora = conn.execute(
+            'SELECT COALESCE(SUM(total), 0), COALESCE(SUM(CASE WHEN hora = ? THEN total END), 0)'
+            ' FROM requisicoes WHERE dia = ?', (hora, dia)
+        ).fetchone()
+        return usado_dia, usado_hora
+
+    def reserve(self, endpoint, tabela_id=None, now=None):
+        """
+        Registra uma requisição se houver orçamento. Retorna 0 quando ela pode
+        seguir, ou quantos segundos faltam para a próxima janela com saldo.
+        """
+        now = now or datetime.now()
+        dia, hora = now.strftime('%Y-%m-%d'), now.hour
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                usado_dia, usado_hora = self._used(conn, dia, hora)
+                if self.diario and usado_dia >= self.diario:
+                    conn.execute('ROLLBACK')
+                    amanha = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+                    return (amanha - now).total_seconds()
+                if self.horario and usado_hora >= self.horario:
+                    conn.execute('ROLLBACK')
+                    proxima = (now + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+                    return (proxima - now).total_seconds()
+                conn.execute(
+                    'INSERT INTO requisicoes (dia, hora, endpoint, tabela_id, total) VALUES (?, ?, ?, ?, 1)'
+                    ' ON CONFLICT (dia, hora, endpoint, tabela_id) DO UPDATE SET total = total + 1',
+                    (dia, hora, endpoint, int(tabela_id or 0))
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return 0
+
+    def remaining(self, now=None):
+        """Saldo do dia e da hora correntes (None quando não há teto)."""
+        now = now or datetime.now()
+        with self._lock:
+            usado_dia, usado_hora = self._used(self._connect(), now.strftime('%Y-%m-%d'), now.hour)
+        return {
+            'dia': max(self.diario - usado_dia, 0) if self.diario else None,
+            'hora': max(self.horario - usado_hora, 0) if self.horario else None
+        }
+
+    def usage(self, dia=None, tabela_id=None):
+        """Requisições por endpoint e tabela; filtra por dia (YYYY-MM-DD) e/ou tabela."""
+        sql = 'SELECT dia, endpoint, tabela_id, SUM(total) FROM requisicoes WHERE 1 = 1'
+        params = []
+        if dia:
+            sql += ' AND dia = ?'
+            params.append(dia)
+        if tabela_id is not None:
+            sql += ' AND tabela_id = ?'
+            params.append(int(tabela_id))
+        sql += ' GROUP BY dia, endpoint, tabela_id ORDER BY dia, endpoint, tabela_id'
+        with self._lock:
+            return [
+                {'dia': d, 'endpoint': e, 'tabela_id': t, 'total': total}
+                for d, e, t, total in self._connect().execute(sql, params)
+            ]
+
+    def forecast(self, requisicoes, now=None):
+        """
+        Quantas janelas diárias a execução vai ocupar: 1 se cabe no saldo de
+        hoje, mais um dia para cada teto diário excedente. Sem teto, None.
+        """
+        if not self.diario:
+            return None
+        saldo = self.remaining(now)['dia']
+        if requisicoes <= saldo:
+            return 1
+        return 1 + math.ceil((requisicoes - saldo) / self.diario)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,108 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+
+KEYS = ['fipe_cod', 'anomod', 'comb_cod']
+FEED_COLUMNS = [
+    'status', 'fipe_cod', 'anomod', 'comb_cod', 'marca', 'modelo',
+    'valor_anterior', 'valor_atual', 'delta', 'delta_pct'
+]
+logger = logging.getLogger(__name__)
+
+
+def read_chunks(filename, columns, chunksize):
+    """Lê um export (CSV ou XLSX) em blocos, só com as colunas necessárias."""
+    if filename.lower().endswith(('.xlsx', '.xls')):
+        # XLSX não tem leitura incremental; lê uma vez e fatia
+        df = pd.read_excel(filename, usecols=columns)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+    else:
+        yield from pd.read_csv(filename, usecols=columns, chunksize=chunksize, dtype={'fipe_cod': str})
+
+
+def normalize(df):
+    df = df.copy()
+    df['fipe_cod'] = df['fipe_cod'].astype(str).str.strip()
+    df['anomod'] = pd.to_numeric(df['anomod'], errors='coerce').fillna(0).astype('int64')
+    df['comb_cod'] = pd.to_numeric(df['comb_cod'], errors='coerce').fillna(0).astype('int64')
+    df['valor'] = pd.to_numeric(df['valor'], errors='coerce').astype('float64')
+    return df
+
+
+def compute_change_feed(anterior, atual, saida, chunksize=100_000, tolerance=0.005):
+    """
+    Compara duas tabelas exportadas por (fipe_cod, anomod, comb_cod) e grava em
+    `saida` (CSV) os veículos novos, removidos e reprecificados, com variação
+    absoluta e percentual.
+
+    A tabela anterior é carregada só com chaves e valor; a atual é processada
+    em blocos, com o casamento de chaves feito de forma vetorizada.
+    Retorna a contagem por status.
+    """
+    columns = KEYS + ['marca', 'modelo', 'valor']
+    prev = pd.concat(
+        [normalize(chunk) for chunk in read_chunks(anterior, columns, chunksize)],
+        ignore_index=True
+    ).drop_duplicates(KEYS, keep='last').reset_index(drop=True)
+    prev_index = pd.MultiIndex.from_frame(prev[KEYS])
+    prev_valor = prev['valor'].to_numpy()
+    seen = np.zeros(len(prev), dtype=bool)
+    # Chaves novas já emitidas: uma chave repetida em outro bloco não conta duas vezes
+    novos_vistos = set()
+    counts = {'novo': 0, 'removido': 0, 'reprecificado': 0}
+
+    if os.path.exists(saida):
+        os.remove(saida)
+
+    def emit(df):
+        if df.empty:
+            return
+        df[FEED_COLUMNS].to_csv(saida, mode='a', header=not os.path.exists(saida), index=False)
+
+    for chunk in read_chunks(atual, columns, chunksize):
+        chunk = normalize(chunk).drop_duplicates(KEYS, keep='last')
+        pos = prev_index.get_indexer(pd.MultiIndex.from_frame(chunk[KEYS]))
+        novos = pos == -1
+        repetidos = np.zeros(len(chunk), dtype=bool)
+        repetidos[~novos] = seen[pos[~novos]]
+        chaves = list(chunk.loc[novos, KEYS].itertuples(index=False, name=None))
+        repetidos[novos] = [chave in novos_vistos for chave in chaves]
+        novos_vistos.update(chaves)
+        chunk, pos, novos = chunk[~repetidos], pos[~repetidos], novos[~repetidos]
+        seen[pos[~novos]] = True
+
+        valor_atual = chunk['valor'].to_numpy()
+        valor_anterior = np.full(len(chunk), np.nan)
+        valor_anterior[~novos] = prev_valor[pos[~novos]]
+        delta = valor_atual - valor_anterior
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta_pct = np.where(valor_anterior != 0, delta / valor_anterior * 100, np.nan)
+        reprecificados = ~novos & (np.abs(delta) > tolerance)
+
+        out = chunk.assign(
+            valor_anterior=valor_anterior,
+            valor_atual=valor_atual,
+            delta=np.round(delta, 2),
+            delta_pct=np.round(delta_pct, 4),
+            status=np.where(novos, 'novo', 'reprecificado')
+        )
+        emit(out[novos | reprecificados])
+        counts['novo'] += int(novos.sum())
+        counts['reprecificado'] += int(reprecificados.sum())
+
+    removidos = prev[~seen]
+    emit(removidos.assign(
+        status='removido',
+        valor_anterior=removidos['valor'],
+        valor_atual=np.nan,
+        delta=np.nan,
+        delta_pct=np.nan
+    ))
+    counts['removido'] = len(removidos)
+    logger.info(
+        f"Variação gravada em {saida}: {counts['novo']} novos, "
+        f"{counts['removido']} removidos, {counts['reprecificado']} reprecificados."
+    )
+    return counts
@@ -0,0 +1,167 @@
+import math
+import sqlite3
+import hashlib
+import logging
+import threading
+
+PROCESSED_DB = 'fipe_processed.db'
+# Espera pelo lock de escrita de outro processo (shards) antes de desistir
+SQLITE_TIMEOUT = 60
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Filtro de Bloom simples para responder rapidamente "com certeza não está".
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class ProcessedIndex:
+    """
+    Índice de veículos já processados, particionado por tabela de referência.
+
+    As chaves ficam em um SQLite em disco e nada é carregado na construção:
+    cada partição só é lida quando a tabela correspondente é consultada pela
+    primeira vez (para montar o filtro de Bloom, se habilitado).
+
+    As inclusões ficam em memória e são gravadas em lote, numa transação
+    curta, a cada `flush_every` chaves ou no `flush`: nenhuma transação de
+    escrita fica aberta entre requisições, e shards em processos paralelos
+    podem compartilhar o mesmo banco.
+    """
+    def __init__(self, path=PROCESSED_DB, bloom=True, error_rate=0.01, min_capacity=100_000, flush_every=50):
+        self.path = path
+        self.bloom = bloom
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.flush_every = flush_every
+        self.pending = 0
+        self._buffer = {}
+        self._conn = None
+        self._filters = {}
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            with self._conn:
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS processados ('
+                    ' tabela_id INTEGER NOT NULL,'
+                    ' chave TEXT NOT NULL,'
+                    ' PRIMARY KEY (tabela_id, chave)'
+                    ') WITHOUT ROWID'
+                )
+        return self._conn
+
+    def _filter(self, tabela_id):
+        bloom = self._filters.get(tabela_id)
+        if bloom is not None and bloom.count <= bloom.capacity:
+            return bloom
+        # Grava o buffer antes: o filtro é montado só a partir do banco
+        self._write_buffer()
+        conn = self._connect()
+        total = conn.execute(
+            'SELECT COUNT(*) FROM processados WHERE tabela_id = ?', (tabela_id,)
+        ).fetchone()[0]
+        bloom = BloomFilter(max(self.min_capacity, total * 2), self.error_rate)
+        for (chave,) in conn.execute('SELECT chave FROM processados WHERE tabela_id = ?', (tabela_id,)):
+            bloom.add(chave)
+        self._filters[tabela_id] = bloom
+        logger.info(f"Partição da tabela {tabela_id} carregada: {total} chaves.")
+        return bloom
+
+    def contains(self, tabela_id, key):
+        tabela_id = int(tabela_id)
+        with self._lock:
+            if (tabela_id, key) in self._buffer:
+                return True
+            if self.bloom and key not in self._filter(tabela_id):
+                return False
+            row = self._connect().execute(
+                'SELECT 1 FROM processados WHERE tabela_id = ? AND chave = ?', (tabela_id, key)
+            ).fetchone()
+            return row is not None
+
+    def add(self, tabela_id, key):
+        tabela_id = int(tabela_id)
+        with self._lock:
+            self._buffer[(tabela_id, key)] = None
+            if self.bloom and tabela_id in self._filters:
+                self._filters[tabela_id].add(key)
+            self.pending += 1
+            if len(self._buffer) >= self.flush_every:
+                self._write_buffer()
+
+    def count(self, tabela_id):
+        with self._lock:
+            self._write_buffer()
+            return self._connect().execute(
+                'SELECT COUNT(*) FROM processados WHERE tabela_id = ?', (int(tabela_id),)
+            ).fetchone()[0]
+
+    def import_legacy(self, keys):
+        """
+        Migra o antigo set global do checkpoint (chaves "tabela-tipo-marca-modelo-ano").
+        """
+        rows = []
+        for key in keys:
+            tabela_id, _, chave = key.partition('-')
+            if tabela_id.isdigit() and chave:
+                rows.append((int(tabela_id), chave))
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO processados (tabela_id, chave) VALUES (?, ?)', rows
+                )
+            self._filters.clear()
+            self.flush()
+        logger.info(f"{len(rows)} chaves migradas do checkpoint antigo.")
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO processados (tabela_id, chave) VALUES (?, ?)', list(self._buffer)
+            )
+        self._buffer.clear()
+
+    def flush(self):
+        with self._lock:
+            self._write_buffer()
+            self.pending = 0
+
+    def close(self):
+        with self._lock:
+            self._write_buffer()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._filters.clear()
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from time import monotonic
+
+
+class CrawlCancelled(Exception):
+    """Coleta interrompida pelo usuário."""
+
+
+class CrawlControl:
+    """
+    Token de controle compartilhado entre a GUI e o crawler.
+
+    Pausa e parada são cooperativas: o crawler consulta o token antes de cada
+    requisição. Na parada, a tarefa asyncio registrada em `bind` também é
+    cancelada, interrompendo as requisições em andamento.
+    """
+    def __init__(self):
+        self._stop = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self._loop = None
+        self._task = None
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def bind(self, loop, task):
+        self._loop = loop
+        self._task = task
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def stop(self):
+        self._stop.set()
+        self._running.set()
+        if self._loop is not None and self._task is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def check(self):
+        if self._stop.is_set():
+            raise CrawlCancelled()
+
+    def wait(self):
+        """Bloqueia enquanto pausado; levanta CrawlCancelled se parado."""
+        while not self._running.wait(0.2):
+            pass
+        self.check()
+
+    async def wait_async(self):
+        while not self._running.is_set():
+            await asyncio.sleep(0.2)
+        self.check()
+
+    def sleep(self, seconds):
+        """Espera interrompível pela parada."""
+        self._stop.wait(seconds)
+        self.check()
+
+    async def sleep_async(self, seconds):
+        fim = monotonic() + seconds
+        while not self._stop.is_set() and fim > monotonic():
+            await asyncio.sleep(min(fim - monotonic(), 1))
+        self.check()
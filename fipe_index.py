@@ -0,0 +1,121 @@
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+from checkpoint import SQLITE_TIMEOUT
+
+FIPE_INDEX_DB = 'fipe_index.db'
+logger = logging.getLogger(__name__)
+
+
+class FipeCodeIndex:
+    """
+    Índice persistente CodigoFipe + AnoModelo + combustível -> parâmetros do
+    ConsultarValorComTodosParametros (marca, modelo, ano, combustível).
+
+    É alimentado pelas coletas completas e permite precificar uma lista de
+    códigos sem percorrer marcas -> modelos -> anos. As inclusões são gravadas
+    em lote, em transações curtas, para não bloquear shards paralelos.
+    """
+    def __init__(self, path=FIPE_INDEX_DB, flush_every=50):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer = {}
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS codigos ('
+                ' fipe_cod TEXT NOT NULL,'
+                ' anomod INTEGER NOT NULL,'
+                ' comb_cod INTEGER NOT NULL,'
+                ' tipo INTEGER NOT NULL,'
+                ' marca_id TEXT NOT NULL,'
+                ' marca_label TEXT,'
+                ' modelo_id TEXT NOT NULL,'
+                ' modelo_label TEXT,'
+                ' ano_value TEXT NOT NULL,'
+                ' atualizado TEXT,'
+                ' PRIMARY KEY (fipe_cod, anomod, comb_cod)'
+                ') WITHOUT ROWID'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS codigos_modelo ON codigos (tipo, marca_id, modelo_id)'
+            )
+            self._conn.commit()
+        return self._conn
+
+    def add(self, fipe_cod, tipo, marca, modelo, ano):
+        """Registra os parâmetros usados para precificar um veículo."""
+        try:
+            anomod, comb_cod = (int(p) for p in str(ano['Value']).split('-'))
+        except ValueError:
+            return
+        with self._lock:
+            self._buffer[(fipe_cod, anomod, comb_cod)] = (
+                fipe_cod, anomod, comb_cod, int(tipo),
+                str(marca['Value']), marca.get('Label'),
+                str(modelo['Value']), modelo.get('Label'),
+                str(ano['Value']), datetime.now().isoformat()
+            )
+            if len(self._buffer) >= self.flush_every:
+                self._write_buffer()
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO codigos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                list(self._buffer.values())
+            )
+        self._buffer.clear()
+
+    def lookup(self, fipe_cod):
+        """
+        Retorna as entradas conhecidas de um código no formato usado pelo
+        crawler: (tipo, marca, modelo, ano), com dicts Value/Label.
+        """
+        with self._lock:
+            self._write_buffer()
+            rows = self._connect().execute(
+                'SELECT tipo, marca_id, marca_label, modelo_id, modelo_label, ano_value'
+                ' FROM codigos WHERE fipe_cod = ? ORDER BY anomod, comb_cod',
+                (fipe_cod,)
+            ).fetchall()
+        return [
+            (
+                tipo,
+                {'Value': marca_id, 'Label': marca_label},
+                {'Value': modelo_id, 'Label': modelo_label},
+                {'Value': ano_value, 'Label': ano_value}
+            )
+            for tipo, marca_id, marca_label, modelo_id, modelo_label, ano_value in rows
+        ]
+
+    def has_model(self, tipo, marca_id, modelo_id):
+        """Indica se o modelo já tem algum código conhecido no índice."""
+        with self._lock:
+            self._write_buffer()
+            row = self._connect().execute(
+                'SELECT 1 FROM codigos WHERE tipo = ? AND marca_id = ? AND modelo_id = ? LIMIT 1',
+                (int(tipo), str(marca_id), str(modelo_id))
+            ).fetchone()
+        return row is not None
+
+    def flush(self):
+        with self._lock:
+            self._write_buffer()
+
+    def close(self):
+        with self._lock:
+            self._write_buffer()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,208 @@
+import os
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+from change_feed import KEYS, read_chunks, normalize
+
+HISTORY_FILE = 'fipe_historico.npz'
+logger = logging.getLogger(__name__)
+
+
+class PriceHistory:
+    """
+    Histórico de preços em uma matriz veículo x mês de referência.
+
+    Cada linha é um (fipe_cod, anomod, comb_cod), com marca e modelo ao lado;
+    cada coluna é um mês (AAAAMM, em ordem). Valores ausentes são NaN.
+    Tudo fica em um único .npz, regravado de forma atômica a cada tabela.
+    """
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.meses = np.empty(0, dtype=np.int32)
+        self.fipe_cod = np.empty(0, dtype='U10')
+        self.anomod = np.empty(0, dtype=np.int32)
+        self.comb_cod = np.empty(0, dtype=np.int16)
+        self.marca = np.empty(0, dtype='U1')
+        self.modelo = np.empty(0, dtype='U1')
+        self.valores = np.empty((0, 0), dtype=np.float64)
+        self._linhas = None
+
+    @classmethod
+    def load(cls, path=HISTORY_FILE):
+        history = cls(path)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                for name in ('meses', 'fipe_cod', 'anomod', 'comb_cod', 'marca', 'modelo', 'valores'):
+                    setattr(history, name, data[name])
+            # Históricos antigos estão em float32; os meses novos guardam os centavos
+            history.valores = history.valores.astype(np.float64, copy=False)
+        return history
+
+    def save(self):
+        tmp = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp, meses=self.meses, fipe_cod=self.fipe_cod, anomod=self.anomod,
+            comb_cod=self.comb_cod, marca=self.marca, modelo=self.modelo, valores=self.valores
+        )
+        os.replace(tmp, self.path)
+
+    def __len__(self):
+        return len(self.fipe_cod)
+
+    def _index(self):
+        return pd.MultiIndex.from_arrays([self.fipe_cod, self.anomod, self.comb_cod], names=KEYS)
+
+    def _coluna(self, mes):
+        """Posição da coluna do mês, criando-a (em ordem) se ainda não existir."""
+        pos = int(np.searchsorted(self.meses, mes))
+        if pos < len(self.meses) and self.meses[pos] == mes:
+            return pos
+        self.meses = np.insert(self.meses, pos, mes)
+        self.valores = np.insert(self.valores, pos, np.nan, axis=1)
+        return pos
+
+    def append_table(self, filename, chunksize=100_000):
+        """
+        Acrescenta um export (CSV/XLSX) de uma tabela. Veículos novos viram
+        linhas novas; o mês vem de anoref/mesref. Retorna os meses gravados.
+        """
+        columns = KEYS + ['marca', 'modelo', 'valor', 'anoref', 'mesref']
+        meses = set()
+        for chunk in read_chunks(filename, columns, chunksize):
+            chunk = normalize(chunk)
+            chunk['mes'] = (
+                pd.to_numeric(chunk['anoref'], errors='coerce').fillna(0).astype('int32') * 100
+                + pd.to_numeric(chunk['mesref'], errors='coerce').fillna(0).astype('int32')
+            )
+            for mes, grupo in chunk.groupby('mes'):
+                if mes <= 0:
+                    continue
+                self._append_month(int(mes), grupo.drop_duplicates(KEYS, keep='last'))
+                meses.add(int(mes))
+        self._linhas = None
+        self.save()
+        logger.info(f"{filename}: {len(meses)} mês(es) gravado(s) no histórico ({len(self)} veículos).")
+        return sorted(meses)
+
+    def _append_month(self, mes, df):
+        coluna = self._coluna(mes)
+        pos = self._index().get_indexer(pd.MultiIndex.from_frame(df[KEYS]))
+        novos = pos == -1
+        if novos.any():
+            extra = df[novos]
+            inicio = len(self)
+            self.fipe_cod = np.concatenate([self.fipe_cod, extra['fipe_cod'].to_numpy(dtype=str)])
+            self.anomod = np.concatenate([self.anomod, extra['anomod'].to_numpy(dtype=np.int32)])
+            self.comb_cod = np.concatenate([self.comb_cod, extra['comb_cod'].to_numpy(dtype=np.int16)])
+            self.marca = np.concatenate([self.marca, extra['marca'].fillna('').to_numpy(dtype=str)])
+            self.modelo = np.concatenate([self.modelo, extra['modelo'].fillna('').to_numpy(dtype=str)])
+            vazio = np.full((len(extra), len(self.meses)), np.nan, dtype=np.float64)
+            self.valores = np.vstack([self.valores, vazio]) if len(self.valores) else vazio
+            pos[novos] = np.arange(inicio, inicio + len(extra))
+        self.valores[pos, coluna] = df['valor'].to_numpy(dtype=np.float64)
+
+    def _rows(self, fipe_cod):
+        if self._linhas is None:
+            # fipe_cod -> linhas, montado uma vez por carga
+            ordem = np.argsort(self.fipe_cod, kind='stable')
+            codigos, inicios = np.unique(self.fipe_cod[ordem], return_index=True)
+            self._linhas = dict(zip(codigos, np.split(ordem, inicios[1:])))
+        return self._linhas.get(str(fipe_cod).strip(), np.empty(0, dtype=np.intp))
+
+    def _mes_pos(self, mes):
+        if mes is None:
+            return len(self.meses) - 1
+        pos = int(np.searchsorted(self.meses, int(mes)))
+        if pos >= len(self.meses) or self.meses[pos] != int(mes):
+            raise KeyError(f"Mês {mes} não está no histórico")
+        return pos
+
+    def serie(self, fipe_cod, anomod=None, comb_cod=None):
+        """Série de preços de um código: meses nas linhas, (anomod, comb_cod) nas colunas."""
+        rows = self._rows(fipe_cod)
+        if anomod is not None:
+            rows = rows[self.anomod[rows] == int(anomod)]
+        if comb_cod is not None:
+            rows = rows[self.comb_cod[rows] == int(comb_cod)]
+        return pd.DataFrame(
+            self.valores[rows].T,
+            index=pd.Index(self.meses, name='mes'),
+            columns=pd.MultiIndex.from_arrays([self.anomod[rows], self.comb_cod[rows]], names=['anomod', 'comb_cod'])
+        )
+
+    def depreciacao(self, fipe_cod, mes=None):
+        """
+        Curva de depreciação de um código em um mês (padrão: o mais recente):
+        preço por ano-modelo e o percentual em relação ao ano-modelo mais novo.
+        """
+        coluna = self._mes_pos(mes)
+        rows = self._rows(fipe_cod)
+        valor = self.valores[rows, coluna]
+        rows, valor = rows[~np.isnan(valor)], valor[~np.isnan(valor)]
+        ordem = np.argsort(-self.anomod[rows], kind='stable')
+        rows, valor = rows[ordem], valor[ordem]
+        # 3200 é o "0 km"; a referência é o modelo mais novo que não seja 0 km, se houver
+        usados = self.anomod[rows] != 3200
+        referencia = valor[usados][0] if usados.any() else (valor[0] if len(valor) else np.nan)
+        ano_ref = self.meses[coluna] // 100
+        return pd.DataFrame({
+            'anomod': self.anomod[rows],
+            'comb_cod': self.comb_cod[rows],
+            'idade': np.where(usados, ano_ref - self.anomod[rows], 0),
+            'valor': valor,
+            'pct_vs_mais_novo': np.round((valor / referencia - 1) * 100, 2)
+        })
+
+    def percentis_marca(self, marca, de, ate=None, percentis=(10, 25, 50, 75, 90)):
+        """
+        Distribuição da variação percentual de preço entre dois meses para
+        todos os veículos da marca presentes nos dois.
+        """
+        c_de, c_ate = self._mes_pos(de), self._mes_pos(ate)
+        rows = np.flatnonzero(np.char.lower(self.marca) == str(marca).lower())
+        antes, depois = self.valores[rows, c_de], self.valores[rows, c_ate]
+        validos = ~np.isnan(antes) & ~np.isnan(depois) & (antes > 0)
+        variacao = (depois[validos] / antes[validos] - 1) * 100
+        resultado = {'veiculos': int(validos.sum())}
+        if len(variacao):
+            resultado.update({
+                f"p{p}": round(float(v), 2) for p, v in zip(percentis, np.percentile(variacao, percentis))
+            })
+        return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Histórico de preços FIPE")
+    parser.add_argument('--arquivo', default=HISTORY_FILE, help="arquivo do histórico (.npz)")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    p = sub.add_parser('adicionar', help="acrescenta exports (CSV/XLSX) ao histórico")
+    p.add_argument('exports', nargs='+')
+    p = sub.add_parser('serie', help="série de preços de um código FIPE")
+    p.add_argument('fipe_cod')
+    p.add_argument('--anomod', type=int)
+    p = sub.add_parser('depreciacao', help="curva de depreciação por ano-modelo")
+    p.add_argument('fipe_cod')
+    p.add_argument('--mes', type=int, help="AAAAMM (padrão: o mais recente)")
+    p = sub.add_parser('marca', help="percentis da variação de preço de uma marca")
+    p.add_argument('marca')
+    p.add_argument('de', type=int, help="AAAAMM")
+    p.add_argument('ate', type=int, nargs='?', help="AAAAMM (padrão: o mais recente)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    history = PriceHistory.load(args.arquivo)
+    if args.comando == 'adicionar':
+        for filename in args.exports:
+            history.append_table(filename)
+    elif args.comando == 'serie':
+        print(history.serie(args.fipe_cod, args.anomod).dropna(how='all').to_string())
+    elif args.comando == 'depreciacao':
+        print(history.depreciacao(args.fipe_cod, args.mes).to_string(index=False))
+    else:
+        print(history.percentis_marca(args.marca, args.de, args.ate))
+
+
+if __name__ == '__main__':
+    main()
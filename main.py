@@ -1,16 +1,23 @@
 import os
-import yaml
+import json
 import pickle
 import logging
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
-from PIL import Image, ImageTk
 import threading
 from time import time, sleep
-from datetime import datetime
-import pandas as pd
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 
+from checkpoint import ProcessedIndex, PROCESSED_DB
+from fipe_index import FipeCodeIndex, FIPE_INDEX_DB
+from control import CrawlControl, CrawlCancelled
+from tracing import Tracer, Profiler
+from planner import CrawlPlan, PLAN_DIR
+from budget import RequestBudget
+from settings import load_settings
+
 # Configurações globais
 CONFIG_FILE = 'config.yaml'
 CHECKPOINT_FILE = 'fipe_checkpoint.pkl'
@@ -22,32 +29,36 @@ class RateLimiter:
         self.tokens = capacity
         self.refill_rate = refill_rate
         self.last_refill = time()
+        # O planejamento consulta as marcas em várias threads
+        self.lock = threading.Lock()
 
     def acquire(self):
-        now = time()
-        elapsed = now - self.last_refill
-        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
-        self.last_refill = now
-        if self.tokens >= 1:
-            self.tokens -= 1
-            return True
-        sleep_time = (1 - self.tokens) / self.refill_rate
-        sleep(sleep_time)
-        return self.acquire()
+        with self.lock:
+            while True:
+                now = time()
+                elapsed = now - self.last_refill
+                self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                sleep_time = (1 - self.tokens) / self.refill_rate
+                sleep(sleep_time)
 
 class FipeSyncCrawler:
-    def __init__(self, gui_callback=None):
+    def __init__(self, gui_callback=None, control=None):
         self.config = None
         self.session = None
         self.rate_limiter = None
-        self.processed = set()
+        self.processed = None
+        self.fipe_index = None
         self.current_table = None
         self.gui_callback = gui_callback
+        self.control = control or CrawlControl()
         self.load_config()
 
     def load_config(self):
-        with open(CONFIG_FILE, encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = load_settings(CONFIG_FILE)
         self.headers = {
             'User-Agent': self.config['user_agents'][0],
             **self.config['default_headers']
@@ -60,11 +71,20 @@ class FipeSyncCrawler:
             capacity=self.config.get('rate_limit_capacity', 5),
             refill_rate=self.config.get('rate_limit_refill', 1)
         )
-        self.processed = self.load_checkpoint()
+        self.processed = ProcessedIndex(
+            self.config.get('processed_db', PROCESSED_DB),
+            bloom=self.config.get('bloom_filter', True),
+            error_rate=self.config.get('bloom_error_rate', 0.01)
+        )
+        self.fipe_index = FipeCodeIndex(self.config.get('fipe_index_db', FIPE_INDEX_DB))
+        self.tracer = Tracer(self.config.get('trace', False))
+        self.budget = RequestBudget.from_config(self.config)
+        self.load_checkpoint()
 
     def save_checkpoint(self):
+        self.processed.flush()
+        self.fipe_index.flush()
         state = {
-            'processed_vehicles': self.processed,
             'current_table': self.current_table,
             'timestamp': datetime.now().isoformat()
         }
@@ -76,37 +96,60 @@ class FipeSyncCrawler:
         try:
             with open(CHECKPOINT_FILE, 'rb') as f:
                 state = pickle.load(f)
-                self.current_table = state.get('current_table')
-                logger.info(f"Checkpoint carregado. Última atualização: {state.get('timestamp')}")
-                return state.get('processed_vehicles', set())
+            self.current_table = state.get('current_table')
+            logger.info(f"Checkpoint carregado. Última atualização: {state.get('timestamp')}")
         except (FileNotFoundError, EOFError, KeyError) as e:
             logger.warning(f"Checkpoint não encontrado ou corrompido: {str(e)}")
-            return set()
+            return
+        # Checkpoints antigos guardavam o set inteiro de chaves no pickle
+        legacy = state.get('processed_vehicles')
+        if legacy:
+            self.processed.import_legacy(legacy)
+            self.save_checkpoint()
 
     def http_post(self, url_key, params, retry=3):
         for attempt in range(retry + 1):
             try:
-                self.rate_limiter.acquire()
-                response = requests.post(
-                    self.urls[url_key],
-                    data=params,
-                    timeout=self.config.get('timeout', 20)
-                )
+                # Ponto de pausa/parada antes de cada requisição
+                self.control.wait()
+                self.aguardar_orcamento(url_key, params)
+                with self.tracer.span('rate_limiter.acquire', 'rede', endpoint=url_key):
+                    self.rate_limiter.acquire()
+                with self.tracer.span('http_post', 'rede', endpoint=url_key, tentativa=attempt):
+                    response = requests.post(
+                        self.urls[url_key],
+                        data=params,
+                        timeout=self.config.get('timeout', 20)
+                    )
                 if response.status_code == 429:
                     retry_after = int(response.headers.get('Retry-After', 60))
                     logger.warning(f"Rate limit atingido. Tentando novamente em {retry_after}s")
-                    sleep(retry_after)
+                    self.control.sleep(retry_after)
                     continue
                 response.raise_for_status()
-                return response.json()
-            except requests.RequestException as e:
+                with self.tracer.span('json_decode', 'rede', endpoint=url_key, bytes=len(response.content)):
+                    return json.loads(response.content)
+            except (requests.RequestException, ValueError) as e:
                 logger.error(f"Falha na requisição: {str(e)}")
                 if attempt < retry:
                     logger.warning(f"Tentativa {attempt + 1} falhou. Tentando novamente...")
-                    sleep(1)
+                    self.control.sleep(1)
                 else:
                     return None
 
+    def aguardar_orcamento(self, url_key, params):
+        """
+        Reserva a requisição no orçamento. Esgotado o teto, adia (de forma
+        interrompível) até a próxima janela em vez de falhar.
+        """
+        tabela_id = params.get('codigoTabelaReferencia')
+        while True:
+            espera = self.budget.reserve(url_key, tabela_id)
+            if not espera:
+                return
+            logger.warning(f"Orçamento de requisições esgotado; retomando em {timedelta(seconds=int(espera))}.")
+            self.control.sleep(espera)
+
     def extract_tabelas(self):
         tabelas = self.http_post('tabelas', {}) or []
         return [
@@ -126,14 +169,63 @@ class FipeSyncCrawler:
         }
         return self.http_post('marcas', params) or []
 
-    def get_modelos(self, tabela_id, tipo, marca_id):
+    def get_modelos_payload(self, tabela_id, tipo, marca_id):
+        # Resposta completa do ConsultarModelos: {'Modelos': [...], 'Anos': [...]}
         params = {
             'codigoTipoVeiculo': tipo,
             'codigoTabelaReferencia': tabela_id,
             'codigoMarca': marca_id
         }
-        response = self.http_post('modelos', params)
-        return response['Modelos'] if response else []
+        return self.http_post('modelos', params) or {}
+
+    def get_modelos(self, tabela_id, tipo, marca_id):
+        return self.get_modelos_payload(tabela_id, tipo, marca_id).get('Modelos') or []
+
+    def get_modelos_por_ano(self, tabela_id, tipo, marca_id, ano):
+        # Retorna None em caso de falha, para o chamador poder recorrer ao ConsultarAnoModelo
+        try:
+            cod, combustivel = ano['Value'].split('-')
+        except ValueError:
+            return None
+        params = {
+            'codigoTipoVeiculo': tipo,
+            'codigoTabelaReferencia': tabela_id,
+            'codigoMarca': marca_id,
+            'ano': ano['Value'],
+            'codigoTipoCombustivel': combustivel,
+            'anoModelo': cod
+        }
+        response = self.http_post('modelos_ano', params)
+        return response if isinstance(response, list) else None
+
+    def get_pares_modelo_ano(self, tabela_id, tipo, marca_id):
+        """
+        Lista os pares (modelo, ano) de uma marca. Usa os anos que já vêm no
+        ConsultarModelos e enumera os modelos por ano (uma requisição por ano),
+        recorrendo ao ConsultarAnoModelo por modelo quando isso for mais caro
+        ou falhar.
+        """
+        payload = self.get_modelos_payload(tabela_id, tipo, marca_id)
+        modelos = payload.get('Modelos') or []
+        anos = payload.get('Anos') or []
+        if anos and len(anos) < len(modelos):
+            respostas = [self.get_modelos_por_ano(tabela_id, tipo, marca_id, ano) for ano in anos]
+            if all(resposta is not None for resposta in respostas):
+                por_id = {str(modelo['Value']): modelo for modelo in modelos}
+                return [
+                    (por_id.get(str(item['Value']), item), ano)
+                    for ano, resposta in zip(anos, respostas)
+                    for item in resposta
+                ]
+            logger.warning(f"Consulta de modelos por ano falhou para a marca {marca_id}; usando ConsultarAnoModelo.")
+        pares = []
+        for modelo in modelos:
+            anos_modelo = self.get_ano_modelos(tabela_id, tipo, marca_id, modelo['Value'])
+            if anos_modelo is None:
+                logger.warning(f"Consulta de anos falhou para o modelo {modelo['Value']} da marca {marca_id}.")
+                return None
+            pares.extend((modelo, ano) for ano in anos_modelo)
+        return pares
 
     def get_ano_modelos(self, tabela_id, tipo, marca_id, modelo_id):
         params = {
@@ -142,7 +234,8 @@ class FipeSyncCrawler:
             'codigoMarca': marca_id,
             'codigoModelo': modelo_id
         }
-        return self.http_post('ano_modelos', params) or []
+        response = self.http_post('ano_modelos', params)
+        return response if isinstance(response, list) else None
 
     def get_veiculo(self, tabela_id, tipo, marca_id, modelo_id, combustivel, ano):
         params = {
@@ -184,9 +277,12 @@ class FipeSyncCrawler:
             'consulta': datetime.now().isoformat()
         }
 
+    def vehicle_key(self, tipo, marca, modelo, ano):
+        return f"{tipo}-{marca['Value']}-{modelo['Value']}-{ano['Value']}"
+
     def process_vehicle(self, tabela_id, tipo, marca, modelo, ano):
-        vehicle_key = f"{tabela_id}-{tipo}-{marca['Value']}-{modelo['Value']}-{ano['Value']}"
-        if vehicle_key in self.processed:
+        # Não marca como processado: isso só acontece depois da entrega, em iter_veiculos
+        if self.processed.contains(tabela_id, self.vehicle_key(tipo, marca, modelo, ano)):
             return None
         try:
             cod, combustivel = ano['Value'].split('-')
@@ -195,35 +291,81 @@ class FipeSyncCrawler:
         veiculo = self.get_veiculo(tabela_id, tipo, marca['Value'], modelo['Value'], combustivel, cod)
         if not veiculo:
             return None
-        self.processed.add(vehicle_key)
-        self.save_checkpoint()
-        data = self.extract_veiculo_data(veiculo)
+        with self.tracer.span('extract_veiculo_data'):
+            data = self.extract_veiculo_data(veiculo)
+        if data and data['fipe_cod']:
+            self.fipe_index.add(data['fipe_cod'], tipo, marca, modelo, ano)
         if self.gui_callback and data:
-            self.gui_callback('save_vehicle', data)
             self.gui_callback('update_current_vehicle', marca['Label'], modelo['Label'], ano['Value'])
         return data
 
-    def get_veiculos_por_tabela(self, tabela_id, tipos):
-        results = []
+    def planejar(self, tabela_id, tipos):
+        """
+        Fase de planejamento: enumera todos os (tipo, marca, modelo, ano) da
+        tabela, consultando as marcas em paralelo, e persiste o plano.
+        Um plano já salvo para a mesma tabela e tipos é reaproveitado.
+        """
+        path = CrawlPlan.path_for(tabela_id, tipos, self.config.get('plan_dir', PLAN_DIR))
+        plano = CrawlPlan.load(path)
+        if plano is not None:
+            return plano
+        plano = CrawlPlan(tabela_id, tipos)
+        incompleto = False
+        modelos = set()
         for tipo in tipos:
             marcas = self.get_marcas(tabela_id, tipo)
-            if self.gui_callback:
-                self.gui_callback('update_progress', 'marcas', len(marcas), 0)
-            for i, marca in enumerate(marcas):
-                modelos = self.get_modelos(tabela_id, tipo, marca['Value'])
-                if self.gui_callback:
-                    self.gui_callback('update_progress', 'modelos', len(modelos), 0)
-                for j, modelo in enumerate(modelos):
-                    anos = self.get_ano_modelos(tabela_id, tipo, marca['Value'], modelo['Value'])
+            incompleto = incompleto or not marcas
+            with ThreadPoolExecutor(max_workers=self.config.get('max_workers', 5)) as executor:
+                futures = {
+                    executor.submit(self.get_pares_modelo_ano, tabela_id, tipo, marca['Value']): marca
+                    for marca in marcas
+                }
+                for i, future in enumerate(as_completed(futures), start=1):
+                    marca = futures[future]
+                    pares = future.result()
+                    incompleto = incompleto or not pares
+                    for modelo, ano in pares or []:
+                        plano.add(tipo, marca, modelo, ano)
+                        modelos.add((tipo, marca['Value'], str(modelo['Value'])))
                     if self.gui_callback:
-                        self.gui_callback('update_progress', 'anos', len(anos), 0)
-                    for k, ano in enumerate(anos):
-                        result = self.process_vehicle(tabela_id, tipo, marca, modelo, ano)
-                        if result:
-                            results.append(result)
-                        if self.gui_callback:
-                            self.gui_callback('update_progress', 'veiculos', len(results), 0)
-        return results
+                        self.gui_callback('update_progress', 'marcas', i, len(marcas))
+                        self.gui_callback('update_progress', 'modelos', len(modelos), len(modelos))
+                        self.gui_callback('update_progress', 'anos', len(plano), len(plano))
+        plano.interleave()
+        if incompleto:
+            # Falhas no catálogo não podem virar um plano persistido sem esses veículos
+            logger.warning("Catálogo incompleto; o plano será usado sem ser salvo.")
+        else:
+            plano.save(path)
+        return plano
+
+    def iter_veiculos(self, tabela_id, tipos, shard=None):
+        """
+        Gera os veículos à medida que são precificados, sem acumulá-los.
+        Primeiro monta (ou carrega) o plano completo, depois o executa.
+        """
+        plano = self.planejar(tabela_id, tipos)
+        pendentes = list(plano.work(self.processed, shard))
+        feitos = len(plano) - len(pendentes)
+        custo = plano.estimate(len(pendentes), self.config.get('rate_limit_refill', 1))
+        dias = self.budget.forecast(custo['requisicoes'])
+        logger.info(
+            f"Plano: {custo['veiculos']} veículos, {custo['pendentes']} pendentes, "
+            f"~{custo['requisicoes']} requisições, estimativa de {timedelta(seconds=int(custo['segundos']))}."
+            + (f" A execução deve ocupar {dias} dia(s) de orçamento." if dias is not None else "")
+        )
+        for tipo, marca, modelo, ano in pendentes:
+            result = self.process_vehicle(tabela_id, tipo, marca, modelo, ano)
+            if result:
+                yield result
+                self.processed.add(tabela_id, self.vehicle_key(tipo, marca, modelo, ano))
+                self.save_checkpoint()
+            feitos += 1
+            if self.gui_callback:
+                self.gui_callback('update_progress', 'veiculos', feitos, len(plano))
+
+    def get_veiculos_por_tabela(self, tabela_id, tipos):
+        return list(self.iter_veiculos(tabela_id, tipos))
 
 
 class FipeGUI(tk.Tk):
@@ -242,7 +384,11 @@ class FipeGUI(tk.Tk):
         self.configure(bg='#f0f0f0')
         self.crawler = None
         self.running = False
-        self.veiculos = []
+        self.control = None  # Token de pausa/parada da coleta atual
+        self.worker = None   # Thread da coleta atual
+        self.tracer = Tracer()  # Substituído pelo do crawler a cada coleta
+        self.veiculos_count = 0
+        self.eta_start = None  # (instante, veículos já feitos) na primeira atualização da execução
         self.progress_bars = {}  # Inicializa o dicionário de barras de progresso
         self.setup_ui()
         self.protocol("WM_DELETE_WINDOW", self.on_close)
@@ -274,10 +420,11 @@ class FipeGUI(tk.Tk):
         header_frame = ttk.Frame(self)
         header_frame.pack(pady=10, fill='x')
         try:
+            from PIL import Image, ImageTk
             img = Image.open('fipe_logo.png').resize((100, 100))
             self.logo = ImageTk.PhotoImage(img)
             ttk.Label(header_frame, image=self.logo).pack(side='left')
-        except FileNotFoundError:
+        except (ImportError, FileNotFoundError):
             pass
         ttk.Label(header_frame, text="Coletor de Dados FIPE",
                   font=('Helvetica', 16, 'bold'), foreground='#2c3e50').pack(pady=10)
@@ -317,6 +464,8 @@ class FipeGUI(tk.Tk):
         # Rótulo para exibir a marca, modelo e ano do veículo atual
         self.current_vehicle_label = ttk.Label(progress_frame, text="Veículo atual: ")
         self.current_vehicle_label.grid(row=len(stages), column=0, sticky='w', pady=2)
+        self.eta_label = ttk.Label(progress_frame, text="Tempo restante: --")
+        self.eta_label.grid(row=len(stages) + 1, column=0, sticky='w', pady=2)
 
     def setup_log_section(self):
         log_frame = ttk.LabelFrame(self, text="Logs")
@@ -331,6 +480,8 @@ class FipeGUI(tk.Tk):
         self.start_btn.pack(side='left', padx=5)
         ttk.Button(control_frame, text="Exportar CSV", command=self.export_csv).pack(side='left', padx=5)
         ttk.Button(control_frame, text="Exportar Excel", command=self.export_excel).pack(side='left', padx=5)
+        self.pause_btn = ttk.Button(control_frame, text="Pausar", command=self.toggle_pause, state='disabled')
+        self.pause_btn.pack(side='left', padx=5)
         ttk.Button(control_frame, text="Parar", command=self.stop_crawler).pack(side='left', padx=5)
 
     def update_progress(self, stage, current, total):
@@ -342,8 +493,21 @@ class FipeGUI(tk.Tk):
         label = self.progress_bars[stage]['label']
         bar['value'] = (current / total) * 100 if total > 0 else 0
         label['text'] = f"{current}/{total}"
+        if stage == 'veiculos':
+            self.update_eta(current, total)
         self.update_idletasks()
 
+    def update_eta(self, current, total):
+        # O plano dá o total exato; a taxa vem dos veículos feitos nesta execução
+        if self.eta_start is None:
+            self.eta_start = (time(), current)
+            return
+        inicio, feitos_inicio = self.eta_start
+        taxa = (current - feitos_inicio) / max(time() - inicio, 1e-6)
+        if taxa > 0:
+            restante = timedelta(seconds=int((total - current) / taxa))
+            self.eta_label['text'] = f"Tempo restante: {restante}"
+
     def update_current_vehicle(self, marca, modelo, ano):
         """Atualiza o rótulo e o log com as informações do veículo atual."""
         self.current_vehicle_label['text'] = f"Veículo atual: {marca} {modelo} ({ano})"
@@ -376,6 +540,7 @@ class FipeGUI(tk.Tk):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         self.csv_filename = f"FIPE_{timestamp}.csv"
         self.excel_filename = f"FIPE_{timestamp}.xlsx"
+        import pandas as pd
         pd.DataFrame(columns=self.headers).to_csv(self.csv_filename, index=False)
         self.selected_table = self.get_selected_table()
         if not self.selected_table:
@@ -383,25 +548,65 @@ class FipeGUI(tk.Tk):
             return
         self.start_btn['state'] = 'disabled'
         self.update_log("Iniciando coleta de dados...")
-        threading.Thread(target=self.run_sync).start()
+        self.running = True
+        self.eta_start = None
+        self.control = CrawlControl()
+        self.pause_btn.configure(state='normal', text="Pausar")
+        self.worker = threading.Thread(target=self.run_sync, daemon=True)
+        self.worker.start()
 
     def run_sync(self):
-        crawler = FipeSyncCrawler(self.gui_callback)
+        crawler = FipeSyncCrawler(self.gui_callback, control=self.control)
+        self.tracer = crawler.tracer
+        profiler = Profiler(crawler.config.get('profile'))
+        profiler.start()
         try:
             tabela_id = int(self.selected_table['id'])
-            self.veiculos = crawler.get_veiculos_por_tabela(tabela_id, [1, 3])
-            self.update_log(f"Coleta concluída! {len(self.veiculos)} veículos coletados.", 'success')
+            self.veiculos_count = 0
+            for veiculo in crawler.iter_veiculos(tabela_id, [1, 3]):
+                self.save_vehicle_data(veiculo)
+            self.update_log(f"Coleta concluída! {self.veiculos_count} veículos coletados.", 'success')
+        except CrawlCancelled:
+            self.update_log("Coleta interrompida. Progresso salvo para retomada.", 'warning')
         except Exception as e:
             self.update_log(f"Erro: {str(e)}", 'error')
         finally:
+            crawler.save_checkpoint()
+            self.save_diagnostics(crawler, profiler)
             self.start_btn.configure(state='normal')
+            self.pause_btn.configure(state='disabled', text="Pausar")
             self.running = False
 
+    def save_diagnostics(self, crawler, profiler):
+        # Trace e perfil ficam ao lado dos arquivos de saída
+        basename = os.path.splitext(self.csv_filename)[0]
+        try:
+            if crawler.tracer.enabled:
+                trace_file = crawler.tracer.export(f"{basename}.trace.json")
+                self.update_log(f"Trace salvo em {trace_file}")
+            profile_file = profiler.stop(basename)
+            if profile_file:
+                self.update_log(f"Perfil salvo em {profile_file}")
+        except Exception as e:
+            self.update_log(f"Erro ao salvar diagnósticos: {str(e)}", 'error')
+
     def stop_crawler(self):
         if self.running:
-            self.running = False
+            self.control.stop()
             self.update_log("Coleta interrompida pelo usuário!", 'warning')
 
+    def toggle_pause(self):
+        if not self.running:
+            return
+        if self.control.paused:
+            self.control.resume()
+            self.pause_btn.configure(text="Pausar")
+            self.update_log("Coleta retomada.", 'info')
+        else:
+            self.control.pause()
+            self.pause_btn.configure(text="Retomar")
+            self.update_log("Coleta pausada.", 'warning')
+
     def validate_selection(self):
         ano = self.ano_combo.get()
         mes = self.mes_combo.get()
@@ -414,6 +619,7 @@ class FipeGUI(tk.Tk):
         if not os.path.exists(self.csv_filename):
             messagebox.showwarning("Aviso", "Nenhum dado para exportar!")
             return
+        import pandas as pd
         df = pd.read_csv(self.csv_filename)
         df.to_csv(self.csv_filename, index=False)
         self.update_log(f"Dados exportados para {self.csv_filename}")
@@ -422,6 +628,7 @@ class FipeGUI(tk.Tk):
         if not os.path.exists(self.csv_filename):
             messagebox.showwarning("Aviso", "Nenhum dado para exportar!")
             return
+        import pandas as pd
         df = pd.read_csv(self.csv_filename)
         df.to_excel(self.excel_filename, index=False)
         self.update_log(f"Dados exportados para {self.excel_filename}")
@@ -431,12 +638,15 @@ class FipeGUI(tk.Tk):
             self.after(0, lambda: self.update_progress(*args))
         elif action == 'update_log':
             self.after(0, lambda: self.update_log(*args))
-        elif action == 'save_vehicle':
-            self.save_vehicle_data(args[0])
         elif action == 'update_current_vehicle':
             self.after(0, lambda: self.update_current_vehicle(*args))
 
     def save_vehicle_data(self, data):
+        with self.tracer.span('save_vehicle_data', 'saida'):
+            self._save_vehicle_data(data)
+
+    def _save_vehicle_data(self, data):
+        import pandas as pd
         try:
             pd.DataFrame([data]).to_csv(
                 self.csv_filename,
@@ -444,7 +654,8 @@ class FipeGUI(tk.Tk):
                 header=False,
                 index=False
             )
-            if len(self.veiculos) % 50 == 0:
+            self.veiculos_count += 1
+            if self.veiculos_count % 50 == 0:
                 df = pd.read_csv(self.csv_filename)
                 df.to_excel(self.excel_filename, index=False)
         except Exception as e:
@@ -454,10 +665,17 @@ class FipeGUI(tk.Tk):
         if self.running:
             if messagebox.askokcancel("Sair", "A coleta está em andamento. Deseja realmente sair?"):
                 self.stop_crawler()
-                self.destroy()
+                self.wait_worker_and_destroy(time() + 30)
         else:
             self.destroy()
 
+    def wait_worker_and_destroy(self, deadline):
+        # Espera (sem travar o Tk) a coleta salvar o checkpoint
+        if self.worker and self.worker.is_alive() and time() < deadline:
+            self.after(100, lambda: self.wait_worker_and_destroy(deadline))
+            return
+        self.destroy()
+
     def get_selected_table(self):
         selected_ano = self.ano_combo.get()
         selected_mes = self.mes_combo.get().split(' ')[0]
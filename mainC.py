@@ -1,29 +1,39 @@
 import os
-import yaml
+import json
+import hashlib
+import argparse
 import pickle
 import logging
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
-from PIL import Image, ImageTk
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 import threading
 from time import time, sleep
 from datetime import datetime, timedelta
-import pandas as pd
-import requests_cache
+from functools import partial
 import asyncio
-import aiohttp
 import queue
-from ttkthemes import ThemedStyle
-from aiocache import cached, Cache  # Para cache assíncrono
+
+from checkpoint import ProcessedIndex, PROCESSED_DB
+from sinks import BackgroundSink, TabularFileWriter
+from fipe_index import FipeCodeIndex, FIPE_INDEX_DB
+from control import CrawlControl, CrawlCancelled
+from tracing import Tracer, Profiler
+from planner import CrawlPlan, PLAN_DIR
+from result_index import ResultIndex
+from budget import RequestBudget
+from settings import load_settings
+from snapshot import Snapshot
 
 # Configurações globais
 CONFIG_FILE = 'config.yaml'
 CHECKPOINT_FILE = 'fipe_checkpoint.pkl'
+HEADERS = [
+    'tabela_id', 'anoref', 'mesref', 'tipo', 'fipe_cod',
+    'marca', 'modelo', 'anomod', 'comb_cod', 'comb_sigla',
+    'comb', 'valor', 'consulta'
+]
 logger = logging.getLogger(__name__)
 
-# Configuração do cache para requests (não usado com aiohttp)
-requests_cache.install_cache('fipe_cache', expire_after=3600)
-
 def format_currency(value):
     """
     Formata o valor para o padrão brasileiro: R$ 999.999,00
@@ -49,18 +59,53 @@ class RateLimiter:
         await asyncio.sleep(sleep_time)
         return await self.acquire()
 
+class TTLCache:
+    """
+    Cache em memória com expiração, por instância do crawler. Ao encher,
+    descarta primeiro os itens vencidos e, se preciso, os mais antigos.
+    """
+    def __init__(self, ttl=3600, max_entries=10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time():
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key, value):
+        if len(self._data) >= self.max_entries:
+            now = time()
+            for k in [k for k, (expires, _) in self._data.items() if expires < now]:
+                del self._data[k]
+            while len(self._data) >= self.max_entries:
+                del self._data[next(iter(self._data))]
+        self._data[key] = (time() + self.ttl, value)
+
 class FipeSyncCrawler:
-    def __init__(self, gui_callback=None):
+    def __init__(self, gui_callback=None, control=None):
         self.config = None
         self.rate_limiter = None
-        self.processed = set()
+        self.processed = None
+        self.fipe_index = None
         self.current_table = None
-        self.gui_callback = gui_callback
+        self.coleta_completa = False  # Última coleta cobriu tudo (plano completo e nada pendente)
+        self._ultimo = None  # (tabela_id, chave) do último veículo gerado, a confirmar
+        self._coleta = None  # (plano, shard, total) da última coleta, até ser conferida
+        self.cache = TTLCache(ttl=3600)
+        # Sem GUI, as mensagens vão para o logging
+        self.gui_callback = gui_callback or self.log_callback
+        self.control = control or CrawlControl()
         self.load_config()
 
     def load_config(self):
-        with open(CONFIG_FILE, encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+        self.config = load_settings(CONFIG_FILE)
         self.headers = {
             'User-Agent': self.config['user_agents'][0],
             **self.config['default_headers']
@@ -73,11 +118,26 @@ class FipeSyncCrawler:
             capacity=self.config.get('rate_limit_capacity', 5),
             refill_rate=self.config.get('rate_limit_refill', 1)
         )
-        self.processed = self.load_checkpoint()
+        self.processed = ProcessedIndex(
+            self.config.get('processed_db', PROCESSED_DB),
+            bloom=self.config.get('bloom_filter', True),
+            error_rate=self.config.get('bloom_error_rate', 0.01)
+        )
+        self.fipe_index = FipeCodeIndex(self.config.get('fipe_index_db', FIPE_INDEX_DB))
+        self.tracer = Tracer(self.config.get('trace', False))
+        self.budget = RequestBudget.from_config(self.config)
+        self.load_checkpoint()
+
+    def log_callback(self, action, *args):
+        if action == 'update_log':
+            message, level = (args + ('info',))[:2]
+            levels = {'error': logging.ERROR, 'warning': logging.WARNING}
+            logger.log(levels.get(level, logging.INFO), message)
 
     def save_checkpoint(self):
+        self.processed.flush()
+        self.fipe_index.flush()
         state = {
-            'processed_vehicles': self.processed,
             'current_table': self.current_table,
             'timestamp': datetime.now().isoformat()
         }
@@ -89,26 +149,50 @@ class FipeSyncCrawler:
         try:
             with open(CHECKPOINT_FILE, 'rb') as f:
                 state = pickle.load(f)
-                self.current_table = state.get('current_table')
-                logger.info(f"Checkpoint carregado. Última atualização: {state.get('timestamp')}")
-                return state.get('processed_vehicles', set())
+            self.current_table = state.get('current_table')
+            logger.info(f"Checkpoint carregado. Última atualização: {state.get('timestamp')}")
         except (FileNotFoundError, EOFError, KeyError) as e:
             logger.warning(f"Checkpoint não encontrado ou corrompido: {str(e)}")
-            return set()
+            return
+        # Checkpoints antigos guardavam o set inteiro de chaves no pickle
+        legacy = state.get('processed_vehicles')
+        if legacy:
+            self.processed.import_legacy(legacy)
+            self.save_checkpoint()
 
-    @cached(ttl=3600, cache=Cache.MEMORY)
     async def http_post(self, session, url_key, params, retry=3):
+        # Só o catálogo se repete; cada preço é consultado uma única vez
+        if url_key == 'veiculo':
+            return await self._http_post(session, url_key, params, retry)
+        key = (url_key, tuple(sorted(params.items())))
+        result = self.cache.get(key)
+        if result is None:
+            result = await self._http_post(session, url_key, params, retry)
+            if result is not None:
+                self.cache.set(key, result)
+        return result
+
+    async def _http_post(self, session, url_key, params, retry=3):
         for attempt in range(retry + 1):
             try:
-                await self.rate_limiter.acquire()
-                async with session.post(self.urls[url_key], data=params, headers=self.headers) as response:
-                    if response.status == 429:
-                        retry_after = int(response.headers.get('Retry-After', 3))
-                        logger.warning(f"Rate limit atingido. Tentando novamente em {retry_after}s")
-                        await asyncio.sleep(retry_after)
-                        continue
-                    response.raise_for_status()
-                    return await response.json()
+                # Ponto de pausa/parada antes de cada requisição
+                await self.control.wait_async()
+                await self.aguardar_orcamento(url_key, params)
+                with self.tracer.span('rate_limiter.acquire', 'rede', endpoint=url_key):
+                    await self.rate_limiter.acquire()
+                with self.tracer.span('http_post', 'rede', endpoint=url_key, tentativa=attempt):
+                    async with session.post(self.urls[url_key], data=params, headers=self.headers) as response:
+                        if response.status == 429:
+                            retry_after = int(response.headers.get('Retry-After', 3))
+                            logger.warning(f"Rate limit atingido. Tentando novamente em {retry_after}s")
+                            await asyncio.sleep(retry_after)
+                            continue
+                        response.raise_for_status()
+                        body = await response.read()
+                with self.tracer.span('json_decode', 'rede', endpoint=url_key, bytes=len(body)):
+                    return json.loads(body)
+            except CrawlCancelled:
+                raise
             except Exception as e:
                 logger.error(f"Falha na requisição: {str(e)}")
                 if attempt < retry:
@@ -117,6 +201,36 @@ class FipeSyncCrawler:
                 else:
                     return None
 
+    async def aguardar_orcamento(self, url_key, params):
+        """
+        Reserva a requisição no orçamento. Esgotado o teto, adia (de forma
+        interrompível) até a próxima janela em vez de falhar. A transação no
+        SQLite roda fora do event loop, que segue atendendo as outras tarefas
+        enquanto outro processo segura o banco.
+        """
+        tabela_id = params.get('codigoTabelaReferencia')
+        while True:
+            espera = await asyncio.to_thread(self.budget.reserve, url_key, tabela_id)
+            if not espera:
+                return
+            self.gui_callback(
+                'update_log',
+                f"Orçamento de requisições esgotado; retomando em {timedelta(seconds=int(espera))}.",
+                'warning'
+            )
+            await self.control.sleep_async(espera)
+
+    def describe_estimate(self, custo):
+        texto = (
+            f"Plano: {custo['veiculos']} veículos, {custo['pendentes']} pendentes, "
+            f"~{custo['requisicoes']} requisições, estimativa de {timedelta(seconds=int(custo['segundos']))}."
+        )
+        dias = self.budget.forecast(custo['requisicoes'])
+        if dias is not None:
+            saldo = self.budget.remaining()['dia']
+            texto += f" Saldo de hoje: {saldo} requisições; a execução deve ocupar {dias} dia(s) de orçamento."
+        return texto
+
     async def extract_tabelas(self, session):
         tabelas = await self.http_post(session, 'tabelas', {}) or []
         return [
@@ -136,14 +250,66 @@ class FipeSyncCrawler:
         }
         return await self.http_post(session, 'marcas', params) or []
 
-    async def get_modelos(self, session, tabela_id, tipo, marca_id):
+    async def get_modelos_payload(self, session, tabela_id, tipo, marca_id):
+        # Resposta completa do ConsultarModelos: {'Modelos': [...], 'Anos': [...]}
         params = {
             'codigoTipoVeiculo': tipo,
             'codigoTabelaReferencia': tabela_id,
             'codigoMarca': marca_id
         }
-        response = await self.http_post(session, 'modelos', params)
-        return response['Modelos'] if response else []
+        return await self.http_post(session, 'modelos', params) or {}
+
+    async def get_modelos(self, session, tabela_id, tipo, marca_id):
+        response = await self.get_modelos_payload(session, tabela_id, tipo, marca_id)
+        return response.get('Modelos') or []
+
+    async def get_modelos_por_ano(self, session, tabela_id, tipo, marca_id, ano):
+        # Retorna None em caso de falha, para o chamador poder recorrer ao ConsultarAnoModelo
+        try:
+            cod, combustivel = ano['Value'].split('-')
+        except ValueError:
+            return None
+        params = {
+            'codigoTipoVeiculo': tipo,
+            'codigoTabelaReferencia': tabela_id,
+            'codigoMarca': marca_id,
+            'ano': ano['Value'],
+            'codigoTipoCombustivel': combustivel,
+            'anoModelo': cod
+        }
+        response = await self.http_post(session, 'modelos_ano', params)
+        return response if isinstance(response, list) else None
+
+    async def get_pares_modelo_ano(self, session, tabela_id, tipo, marca_id):
+        """
+        Lista os pares (modelo, ano) de uma marca. Usa os anos que já vêm no
+        ConsultarModelos e enumera os modelos por ano (uma requisição por ano),
+        recorrendo ao ConsultarAnoModelo por modelo quando isso for mais caro
+        ou falhar.
+        """
+        payload = await self.get_modelos_payload(session, tabela_id, tipo, marca_id)
+        modelos = payload.get('Modelos') or []
+        anos = payload.get('Anos') or []
+        if anos and len(anos) < len(modelos):
+            respostas = await asyncio.gather(*(
+                self.get_modelos_por_ano(session, tabela_id, tipo, marca_id, ano) for ano in anos
+            ))
+            if all(resposta is not None for resposta in respostas):
+                por_id = {str(modelo['Value']): modelo for modelo in modelos}
+                return [
+                    (por_id.get(str(item['Value']), item), ano)
+                    for ano, resposta in zip(anos, respostas)
+                    for item in resposta
+                ]
+            logger.warning(f"Consulta de modelos por ano falhou para a marca {marca_id}; usando ConsultarAnoModelo.")
+        pares = []
+        for modelo in modelos:
+            anos_modelo = await self.get_ano_modelos(session, tabela_id, tipo, marca_id, modelo['Value'])
+            if anos_modelo is None:
+                logger.warning(f"Consulta de anos falhou para o modelo {modelo['Value']} da marca {marca_id}.")
+                return None
+            pares.extend((modelo, ano) for ano in anos_modelo)
+        return pares
 
     async def get_ano_modelos(self, session, tabela_id, tipo, marca_id, modelo_id):
         params = {
@@ -152,7 +318,8 @@ class FipeSyncCrawler:
             'codigoMarca': marca_id,
             'codigoModelo': modelo_id
         }
-        return await self.http_post(session, 'ano_modelos', params) or []
+        response = await self.http_post(session, 'ano_modelos', params)
+        return response if isinstance(response, list) else None
 
     async def get_veiculo(self, session, tabela_id, tipo, marca_id, modelo_id, combustivel, ano):
         params = {
@@ -194,9 +361,12 @@ class FipeSyncCrawler:
             'consulta': datetime.now().isoformat()
         }
 
-    async def process_vehicle(self, session, tabela_id, tipo, marca, modelo, ano):
-        vehicle_key = f"{tabela_id}-{tipo}-{marca['Value']}-{modelo['Value']}-{ano['Value']}"
-        if vehicle_key in self.processed:
+    def vehicle_key(self, tipo, marca, modelo, ano):
+        return f"{tipo}-{marca['Value']}-{modelo['Value']}-{ano['Value']}"
+
+    async def process_vehicle(self, session, tabela_id, tipo, marca, modelo, ano, indice=True):
+        # Não marca como processado: isso só acontece em consumir(), depois da entrega
+        if indice and self.processed.contains(tabela_id, self.vehicle_key(tipo, marca, modelo, ano)):
             return None
         try:
             cod, combustivel = ano['Value'].split('-')
@@ -205,41 +375,266 @@ class FipeSyncCrawler:
         veiculo = await self.get_veiculo(session, tabela_id, tipo, marca['Value'], modelo['Value'], combustivel, cod)
         if not veiculo:
             return None
-        self.processed.add(vehicle_key)
-        if len(self.processed) % 50 == 0:
-            self.save_checkpoint()
-        data = self.extract_veiculo_data(veiculo)
+        with self.tracer.span('extract_veiculo_data'):
+            data = self.extract_veiculo_data(veiculo)
+        if data and data['fipe_cod']:
+            self.fipe_index.add(data['fipe_cod'], tipo, marca, modelo, ano)
         if self.gui_callback and data:
-            # Registra os dados na tabela e inclui ANOMOD no log
-            self.gui_callback('save_vehicle', data)
+            # Inclui ANOMOD no log
             ano_mod = "0 KM" if data['anomod'] == 3200 else data['anomod']
             formatted = f"{data['marca']} | {data['modelo']} | {ano_mod}"
             self.gui_callback('update_log', formatted, 'info')
         return data
 
-    async def get_veiculos_por_tabela(self, session, tabela_id, tipos):
-        results = []
+    async def traced_process_vehicle(self, session, tabela_id, tipo, marca, modelo, ano, indice=True):
+        with self.tracer.span('process_vehicle', marca=marca['Label'], modelo=modelo['Label'], ano=ano['Value']):
+            return await self.process_vehicle(session, tabela_id, tipo, marca, modelo, ano, indice)
+
+    def confirmacao(self):
+        """
+        Callback que marca como processado o último veículo gerado. O
+        consumidor o repassa ao sink, que só o chama depois de gravar o lote:
+        veículos descartados ou de lotes que falharam voltam na retomada.
+        None quando o veículo não entra no índice (consulta por código).
+        """
+        if self._ultimo is None:
+            return None
+        return partial(self.processed.add, *self._ultimo)
+
+    async def consumir(self, session, tabela_id, trabalhos, indice=True):
+        """
+        Precifica (tipo, marca, modelo, ano) com no máximo `max_workers` tarefas
+        simultâneas e gera os veículos conforme ficam prontos. O veículo não é
+        marcado como processado aqui, e sim pelo callback de confirmacao(),
+        depois de gravado; uma parada nunca perde registros. Tarefas
+        pendentes são canceladas se o consumidor parar.
+
+        Com `indice=False` (consulta por código), o índice de processados não
+        é consultado nem atualizado: a consulta pontual não depende da coleta
+        completa da tabela e não a afeta.
+        """
+        limite = self.config.get('max_workers', 5)
+        trabalhos = iter(trabalhos)
+        pendentes = {}
+
+        def abastecer():
+            while len(pendentes) < limite:
+                try:
+                    tipo, marca, modelo, ano = next(trabalhos)
+                except StopIteration:
+                    return
+                task = asyncio.create_task(
+                    self.traced_process_vehicle(session, tabela_id, tipo, marca, modelo, ano, indice)
+                )
+                pendentes[task] = self.vehicle_key(tipo, marca, modelo, ano)
+
+        try:
+            abastecer()
+            while pendentes:
+                prontos, _ = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                keys = [(task, pendentes.pop(task)) for task in prontos]
+                abastecer()
+                for task, key in keys:
+                    res = task.result()
+                    if not res:
+                        continue
+                    self._ultimo = (tabela_id, key) if indice else None
+                    yield res
+                    self._ultimo = None
+                    if self.processed.pending >= 50:
+                        self.save_checkpoint()
+        finally:
+            for task in pendentes:
+                task.cancel()
+
+    async def planejar(self, session, tabela_id, tipos):
+        """
+        Fase de planejamento: enumera todos os (tipo, marca, modelo, ano) da
+        tabela, com todas as marcas consultadas em paralelo, e persiste o plano.
+        Um plano já salvo para a mesma tabela e tipos é reaproveitado.
+        """
+        path = CrawlPlan.path_for(tabela_id, tipos, self.config.get('plan_dir', PLAN_DIR))
+        plano = CrawlPlan.load(path)
+        if plano is not None:
+            self.gui_callback('update_log', f"Plano carregado: {len(plano)} veículos.", 'info')
+            return plano
+        plano = CrawlPlan(tabela_id, tipos)
+        incompleto = False
         for tipo in tipos:
-            self.gui_callback('update_log', f"Carregando marcas para o tipo {tipo}...", 'info')
+            self.gui_callback('update_log', f"Planejando tipo {tipo}: carregando marcas...", 'info')
             marcas = await self.get_marcas(session, tabela_id, tipo)
-            self.gui_callback('update_log', f"{len(marcas)} marcas carregadas.", 'info')
+            self.gui_callback('update_log', f"{len(marcas)} marcas carregadas. Enumerando modelos e anos...", 'info')
+            pares_por_marca = await asyncio.gather(*(
+                self.get_pares_modelo_ano(session, tabela_id, tipo, marca['Value']) for marca in marcas
+            ))
+            incompleto = incompleto or not marcas or not all(pares_por_marca)
+            for marca, pares in zip(marcas, pares_por_marca):
+                for modelo, ano in pares or []:
+                    plano.add(tipo, marca, modelo, ano)
+        plano.interleave()
+        if incompleto:
+            # Falhas no catálogo não podem virar um plano persistido sem esses veículos
+            plano.completo = False
+            self.gui_callback('update_log', "Catálogo incompleto; o plano será usado sem ser salvo.", 'warning')
+        else:
+            plano.save(path)
+        return plano
+
+    async def executar(self, session, plano, shard=None):
+        """
+        Fase de execução: precifica os itens pendentes do plano.
+        """
+        pendentes = sum(1 for _ in plano.work(self.processed, shard))
+        custo = plano.estimate(pendentes, self.config.get('rate_limit_refill', 1))
+        self.gui_callback('update_plan', len(plano), len(plano) - pendentes)
+        self.gui_callback('update_log', self.describe_estimate(custo), 'info')
+        async for res in self.consumir(session, plano.tabela_id, plano.work(self.processed, shard)):
+            yield res
+
+    async def iter_veiculos(self, session, tabela_id, tipos, shard=None):
+        """
+        Gera os veículos à medida que são precificados, sem acumulá-los.
+        Com `shard=(i, n)`, processa só a i-ésima de n partes do plano.
+        """
+        self.coleta_completa = False
+        self._coleta = None
+        plano = await self.planejar(session, tabela_id, tipos)
+        total = 0
+        async for res in self.executar(session, plano, shard):
+            total += 1
+            yield res
+        self._coleta = (plano, shard, total)
+
+    def concluir_coleta(self):
+        """
+        Confere se a última coleta cobriu o plano inteiro. Chamado depois que o
+        sink gravou tudo, já que só então os veículos contam como processados.
+        """
+        if self._coleta is None:
+            return self.coleta_completa
+        plano, shard, total = self._coleta
+        self._coleta = None
+        restantes = sum(1 for _ in plano.work(self.processed, shard))
+        self.coleta_completa = plano.completo and restantes == 0
+        if self.coleta_completa:
+            self.gui_callback('update_log', f"Coleta concluída! {total} veículos processados.", 'success')
+        else:
+            self.gui_callback(
+                'update_log',
+                f"Coleta parcial: {total} veículos processados, {restantes} pendentes"
+                f"{'' if plano.completo else ', catálogo incompleto'}.",
+                'warning'
+            )
+        return self.coleta_completa
+
+    async def get_veiculos_por_tabela(self, session, tabela_id, tipos):
+        return [veiculo async for veiculo in self.iter_veiculos(session, tabela_id, tipos)]
+
+    async def iter_veiculos_por_codigo(self, session, tabela_id, codigos, tipos):
+        """
+        Precifica uma lista de CodigoFipe direto pelo índice de códigos,
+        recorrendo ao catálogo apenas para os códigos que não estão nele.
+        Não usa o índice de processados: os códigos pedidos são sempre
+        precificados, e a coleta completa da tabela continua intacta.
+        A consulta é completa se todos os códigos foram encontrados e todas
+        as entradas do índice foram precificadas.
+        """
+        self.coleta_completa = False
+        self._coleta = None
+        faltantes = set()
+        trabalhos = []
+        for codigo in dict.fromkeys(codigos):
+            entradas = self.fipe_index.lookup(codigo)
+            if not entradas:
+                faltantes.add(codigo)
+            trabalhos.extend(entradas)
+        total = 0
+        async for res in self.consumir(session, tabela_id, trabalhos, indice=False):
+            total += 1
+            yield res
+        self.gui_callback(
+            'update_log',
+            f"{total} veículos precificados pelo índice; {len(faltantes)} códigos fora do índice.",
+            'info'
+        )
+        if faltantes:
+            # localizar_no_catalogo retira de `faltantes` os códigos encontrados
+            async for veiculo in self.localizar_no_catalogo(session, tabela_id, tipos, faltantes):
+                yield veiculo
+        self.coleta_completa = total == len(trabalhos) and not faltantes
+
+    async def localizar_no_catalogo(self, session, tabela_id, tipos, faltantes):
+        """
+        Percorre o catálogo atrás dos códigos ausentes do índice. Cada modelo
+        desconhecido é amostrado com um único ano para descobrir seu código,
+        e todos os seus anos entram no índice; só os modelos procurados têm
+        todos os anos precificados. Os códigos encontrados são retirados de
+        `faltantes`.
+        """
+        for tipo in tipos:
+            marcas = await self.get_marcas(session, tabela_id, tipo) if faltantes else []
             for marca in marcas:
-                self.gui_callback('update_log', f"Carregando modelos para a marca {marca['Label']}...", 'info')
-                modelos = await self.get_modelos(session, tabela_id, tipo, marca['Value'])
-                self.gui_callback('update_log', f"{len(modelos)} modelos carregados.", 'info')
-                for modelo in modelos:
-                    self.gui_callback('update_log', f"Carregando anos para o modelo {modelo['Label']}...", 'info')
-                    anos = await self.get_ano_modelos(session, tabela_id, tipo, marca['Value'], modelo['Value'])
-                    self.gui_callback('update_log', f"{len(anos)} anos carregados.", 'info')
-                    tasks = []
+                pares = await self.get_pares_modelo_ano(session, tabela_id, tipo, marca['Value']) if faltantes else []
+                modelos = {}
+                for modelo, ano in pares or []:
+                    modelos.setdefault(str(modelo['Value']), (modelo, []))[1].append(ano)
+                for modelo, anos in modelos.values():
+                    if not faltantes:
+                        break
+                    # Um modelo corresponde a um único código: se já está no índice, não é procurado
+                    if self.fipe_index.has_model(tipo, marca['Value'], modelo['Value']):
+                        continue
+                    try:
+                        cod, combustivel = anos[0]['Value'].split('-')
+                    except ValueError:
+                        continue
+                    amostra = await self.get_veiculo(session, tabela_id, tipo, marca['Value'], modelo['Value'], combustivel, cod)
+                    codigo = amostra.get('CodigoFipe') if amostra else None
+                    if not codigo:
+                        continue
+                    # Todos os anos de um modelo têm o mesmo código: indexa todos, não só a
+                    # amostra, para que a próxima consulta pelo índice traga o modelo inteiro
                     for ano in anos:
-                        tasks.append(asyncio.create_task(self.process_vehicle(session, tabela_id, tipo, marca, modelo, ano)))
-                    results_tasks = await asyncio.gather(*tasks)
-                    for res in results_tasks:
-                        if res:
-                            results.append(res)
-        self.gui_callback('update_log', f"Coleta concluída! {len(results)} veículos processados.", 'success')
-        return results
+                        self.fipe_index.add(codigo, tipo, marca, modelo, ano)
+                    if codigo not in faltantes:
+                        continue
+                    faltantes.discard(codigo)
+                    # A amostra já é o preço do primeiro ano: entregue sem nova requisição
+                    data = self.extract_veiculo_data(amostra)
+                    if data:
+                        yield data
+                    trabalhos = [(tipo, marca, modelo, ano) for ano in anos[1:]]
+                    async for res in self.consumir(session, tabela_id, trabalhos, indice=False):
+                        yield res
+        if faltantes:
+            self.gui_callback('update_log', f"Códigos não encontrados na tabela {tabela_id}: {', '.join(sorted(faltantes))}", 'warning')
+
+class GUIVehicleWriter:
+    """
+    Writer do sink para a GUI: grava os arquivos e repassa as linhas à Treeview.
+    Roda na thread do sink.
+    """
+    def __init__(self, gui, file_writer):
+        self.gui = gui
+        self.file_writer = file_writer
+
+    def write_batch(self, batch):
+        self.gui.veiculos_processados += len(batch)
+        self.gui.tree_queue.put(batch)
+        try:
+            with self.gui.tracer.span('save_vehicle_data', 'saida', registros=len(batch)):
+                self.file_writer.write_batch(batch)
+            self.gui.update_log(f"Lote de {len(batch)} veículos gravado com sucesso.", 'success')
+        except Exception as e:
+            self.gui.update_log(f"Erro ao salvar dados: {str(e)}", 'error')
+            # Repassa ao sink para que o lote não seja confirmado como processado
+            raise
+
+    def close(self):
+        try:
+            self.file_writer.close()
+        except Exception as e:
+            self.gui.update_log(f"Erro ao salvar XLSX: {str(e)}", 'error')
 
 class FipeGUI(tk.Tk):
     def __init__(self):
@@ -247,27 +642,35 @@ class FipeGUI(tk.Tk):
         self.tables = []
         self.csv_filename = None
         self.excel_filename = None
-        self.headers = [
-            'tabela_id', 'anoref', 'mesref', 'tipo', 'fipe_cod',
-            'marca', 'modelo', 'anomod', 'comb_cod', 'comb_sigla',
-            'comb', 'valor', 'consulta'
-        ]
+        self.snapshot_dir = None      # Snapshot colunar da coleta atual (gravado no fim)
+        self.snapshot = None          # Snapshot de uma execução carregada
+        self.headers = HEADERS
         self.title("FIPE Crawler GUI")
         self.geometry("1200x800")
         self.configure(bg='#f0f0f0')
         self.crawler = None
         self.running = False
-        self.veiculos = []          # Armazena TODOS os veículos processados
-        self.xlsx_saved_count = 0   # Contador para controle do XLSX incremental
         self.log_queue = queue.Queue()  # Fila para logs
+        self.tree_queue = queue.Queue()  # Fila de linhas para a Treeview
+        self.result_index = ResultIndex()  # Índice dos veículos exibidos, para o filtro
+        self.filtro = None          # Filtro ativo na Treeview (None = todos)
+        self.sink = None
+        self.control = None         # Token de pausa/parada da coleta atual
+        self.tracer = Tracer()      # Substituído pelo do crawler a cada coleta
+        self.worker = None          # Thread da coleta atual
         self.start_time = None      # Tempo de início do processamento
         self.veiculos_processados = 0  # Contador de veículos processados
+        self.total_plano = 0        # Total de veículos do plano da coleta atual
+        self.ja_processados = 0     # Veículos do plano concluídos em execuções anteriores
+        self.inicio_execucao = None # Fim do planejamento: base da velocidade e do ETA
         self.setup_ui()
         self.protocol("WM_DELETE_WINDOW", self.on_close)
         self.after(100, lambda: self.update_log("Aplicativo inicializado com sucesso!", 'info'))
         self.after(100, self.process_log_queue)
+        self.after(200, self.process_tree_queue)
 
     def setup_ui(self):
+        from ttkthemes import ThemedStyle
         style = ThemedStyle(self)
         style.set_theme("keramik")
         self.setup_header()
@@ -281,10 +684,11 @@ class FipeGUI(tk.Tk):
         header_frame = ttk.Frame(self)
         header_frame.pack(pady=10, fill='x')
         try:
+            from PIL import Image, ImageTk
             img = Image.open('fipe_logo.png').resize((100, 100))
             self.logo = ImageTk.PhotoImage(img)
             ttk.Label(header_frame, image=self.logo).pack(side='left')
-        except FileNotFoundError:
+        except (ImportError, FileNotFoundError):
             pass
         ttk.Label(header_frame, text="Coletor de Dados FIPE",
                   font=('Helvetica', 16, 'bold'), foreground='#2c3e50').pack(pady=10)
@@ -326,6 +730,7 @@ class FipeGUI(tk.Tk):
     def setup_table_section(self):
         table_frame = ttk.LabelFrame(self, text="Veículos Processados")
         table_frame.pack(pady=10, padx=20, fill='both', expand=True)
+        self.setup_filter_bar(table_frame)
         columns = ("Marca", "Modelo", "AnoMod", "Sigla Combustível", "Valor (em reais)")
         self.tree = ttk.Treeview(table_frame, columns=columns, show='headings')
         for col in columns:
@@ -336,13 +741,107 @@ class FipeGUI(tk.Tk):
         scrollbar.pack(side="right", fill="y")
         self.tree.pack(fill='both', expand=True)
 
+    def setup_filter_bar(self, parent):
+        filter_frame = ttk.Frame(parent)
+        filter_frame.pack(fill='x', pady=5)
+        ttk.Label(filter_frame, text="Marca:").pack(side='left', padx=2)
+        self.filtro_marca = ttk.Combobox(
+            filter_frame, width=15,
+            postcommand=lambda: self.filtro_marca.configure(values=[''] + self.result_index.marcas())
+        )
+        self.filtro_marca.pack(side='left', padx=2)
+        ttk.Label(filter_frame, text="Modelo:").pack(side='left', padx=2)
+        self.filtro_modelo = ttk.Entry(filter_frame, width=20)
+        self.filtro_modelo.pack(side='left', padx=2)
+        ttk.Label(filter_frame, text="Ano:").pack(side='left', padx=2)
+        self.filtro_ano = ttk.Entry(filter_frame, width=7)
+        self.filtro_ano.pack(side='left', padx=2)
+        ttk.Label(filter_frame, text="Combustível:").pack(side='left', padx=2)
+        self.filtro_comb = ttk.Combobox(
+            filter_frame, width=4, state='readonly',
+            postcommand=lambda: self.filtro_comb.configure(values=[''] + self.result_index.combustiveis())
+        )
+        self.filtro_comb.pack(side='left', padx=2)
+        ttk.Label(filter_frame, text="Preço de:").pack(side='left', padx=2)
+        self.filtro_preco_min = ttk.Entry(filter_frame, width=10)
+        self.filtro_preco_min.pack(side='left', padx=2)
+        ttk.Label(filter_frame, text="até:").pack(side='left', padx=2)
+        self.filtro_preco_max = ttk.Entry(filter_frame, width=10)
+        self.filtro_preco_max.pack(side='left', padx=2)
+        ttk.Button(filter_frame, text="Filtrar", command=self.apply_filter).pack(side='left', padx=5)
+        ttk.Button(filter_frame, text="Limpar", command=self.clear_filter).pack(side='left', padx=2)
+        self.filtro_label = ttk.Label(filter_frame, text="")
+        self.filtro_label.pack(side='left', padx=5)
+        for widget in (self.filtro_marca, self.filtro_modelo, self.filtro_ano,
+                       self.filtro_preco_min, self.filtro_preco_max):
+            widget.bind("<Return>", lambda event: self.apply_filter())
+        self.filtro_comb.bind("<<ComboboxSelected>>", lambda event: self.apply_filter())
+
+    def read_filter(self):
+        """
+        Lê a barra de filtro. Retorna None se nenhum campo estiver preenchido.
+        """
+        def preco(entry):
+            texto = entry.get().strip().replace('R$', '').replace(' ', '')
+            if not texto:
+                return None
+            # Formato pt-BR, como na tabela: ponto separa milhares, vírgula os centavos
+            return float(texto.replace('.', '').replace(',', '.'))
+
+        ano = self.filtro_ano.get().strip()
+        if ano.lower() in ('0 km', '0km'):
+            ano = '3200'
+        filtro = {
+            'marca': self.filtro_marca.get().strip() or None,
+            'modelo': self.filtro_modelo.get().strip() or None,
+            'ano': ano or None,
+            'comb': self.filtro_comb.get().strip() or None,
+            'preco_min': preco(self.filtro_preco_min),
+            'preco_max': preco(self.filtro_preco_max),
+        }
+        if all(valor is None for valor in filtro.values()):
+            return None
+        return filtro
+
+    def apply_filter(self):
+        try:
+            self.filtro = self.read_filter()
+        except ValueError:
+            messagebox.showerror("Erro", "Faixa de preço inválida!")
+            return
+        # Reanexa só as linhas que atendem ao filtro, sem recriar os itens
+        if self.filtro is None:
+            ids = range(len(self.result_index))
+        else:
+            ids = self.result_index.search(**self.filtro)
+        self.tree.set_children('', *(f"r{row_id}" for row_id in ids))
+        self.update_filter_label()
+
+    def clear_filter(self):
+        for widget in (self.filtro_marca, self.filtro_modelo, self.filtro_ano,
+                       self.filtro_preco_min, self.filtro_preco_max):
+            widget.delete(0, 'end')
+        self.filtro_comb.set('')
+        self.apply_filter()
+
+    def update_filter_label(self):
+        if self.filtro is None:
+            self.filtro_label.configure(text="")
+        else:
+            exibidos = len(self.tree.get_children())
+            self.filtro_label.configure(text=f"{exibidos} de {len(self.result_index)} veículos")
+
     def setup_control_buttons(self):
         control_frame = ttk.Frame(self)
         control_frame.pack(pady=10)
         self.start_btn = ttk.Button(control_frame, text="Iniciar", command=self.start_crawler)
         self.start_btn.pack(side='left', padx=5)
+        ttk.Button(control_frame, text="Carregar Execução", command=self.load_run).pack(side='left', padx=5)
         ttk.Button(control_frame, text="Exportar CSV", command=self.export_csv).pack(side='left', padx=5)
         ttk.Button(control_frame, text="Exportar Excel", command=self.export_excel).pack(side='left', padx=5)
+        ttk.Button(control_frame, text="Comparar com Anterior", command=self.export_change_feed).pack(side='left', padx=5)
+        self.pause_btn = ttk.Button(control_frame, text="Pausar", command=self.toggle_pause, state='disabled')
+        self.pause_btn.pack(side='left', padx=5)
         ttk.Button(control_frame, text="Parar", command=self.stop_crawler).pack(side='left', padx=5)
 
     def update_meses(self, event=None):
@@ -351,6 +850,7 @@ class FipeGUI(tk.Tk):
             return
 
         async def async_update_meses():
+            import aiohttp
             crawler = FipeSyncCrawler()
             async with aiohttp.ClientSession() as session:
                 tables = await crawler.extract_tabelas(session)
@@ -391,6 +891,7 @@ class FipeGUI(tk.Tk):
 
     def load_tables(self):
         async def async_load_tables():
+            import aiohttp
             crawler = FipeSyncCrawler()
             async with aiohttp.ClientSession() as session:
                 self.tables = await crawler.extract_tabelas(session)
@@ -403,10 +904,11 @@ class FipeGUI(tk.Tk):
         if not self.validate_selection():
             return
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        # CSV será gerado apenas quando clicado no botão
+        # CSV e XLSX são gravados em lotes pela thread do sink
         self.csv_filename = f"FIPE_{timestamp}.csv"
-        # XLSX será salvo incrementalmente a cada 10 veículos
         self.excel_filename = f"FIPE_{timestamp}.xlsx"
+        self.snapshot_dir = f"FIPE_{timestamp}.snap"
+        self.snapshot = None
         self.selected_table = self.get_selected_table()
         if not self.selected_table:
             messagebox.showerror("Erro", "Nenhuma tabela válida selecionada!")
@@ -415,8 +917,12 @@ class FipeGUI(tk.Tk):
         self.update_log("PROCESSAMENTO INICIADO.", 'info')
         self.start_time = datetime.now()
         self.veiculos_processados = 0
-        self.xlsx_saved_count = 0
+        self.total_plano = 0
+        self.ja_processados = 0
+        self.inicio_execucao = None
         self.running = True
+        self.control = CrawlControl()
+        self.pause_btn.configure(state='normal', text="Pausar")
 
         tipo_selecionado = self.tipo_veiculo_combo.get()
         if tipo_selecionado == "1 - Automóveis":
@@ -430,30 +936,93 @@ class FipeGUI(tk.Tk):
         else:
             tipos = [1]
 
-        threading.Thread(target=self.run_sync, args=(tipos,), daemon=True).start()
+        self.worker = threading.Thread(target=self.run_sync, args=(tipos,), daemon=True)
+        self.worker.start()
 
     def run_sync(self, tipos):
+        crawler = FipeSyncCrawler(self.gui_callback, control=self.control)
+        self.tracer = crawler.tracer
+        self.sink = self.create_sink(crawler.config)
+        profiler = Profiler(crawler.config.get('profile'))
+        profiler.start()
+
         async def async_run_sync():
+            import aiohttp
+            # Permite que "Parar" cancele as requisições em andamento
+            self.control.bind(asyncio.get_running_loop(), asyncio.current_task())
             # Aumenta o limite de conexões para maior paralelismo
             connector = aiohttp.TCPConnector(limit=50)
-            crawler = FipeSyncCrawler(self.gui_callback)
             try:
                 tabela_id = int(self.selected_table['id'])
                 async with aiohttp.ClientSession(connector=connector) as session:
-                    self.veiculos = await crawler.get_veiculos_por_tabela(session, tabela_id, tipos)
-                    self.update_log(f"Coleta concluída! {len(self.veiculos)} veículos coletados.", 'success')
+                    total = 0
+                    async for veiculo in crawler.iter_veiculos(session, tabela_id, tipos):
+                        # A gravação acontece na thread do sink; aqui só se enfileira
+                        if await self.sink.put_async(veiculo, crawler.confirmacao()):
+                            total += 1
+                    self.update_log(f"Coleta concluída! {total} veículos coletados.", 'success')
+            except (asyncio.CancelledError, CrawlCancelled):
+                self.update_log("Coleta interrompida. Progresso salvo para retomada.", 'warning')
             except Exception as e:
                 self.update_log(f"Erro: {str(e)}", 'error')
             finally:
+                crawler.save_checkpoint()
                 self.start_btn.configure(state='normal')
-                self.running = False
-        asyncio.run(async_run_sync())
+                self.pause_btn.configure(state='disabled', text="Pausar")
+        try:
+            asyncio.run(async_run_sync())
+        finally:
+            # Descarrega o que ainda estiver na fila antes de liberar a thread
+            self.sink.close()
+            # Grava as confirmações feitas pelo sink ao descarregar a fila
+            crawler.save_checkpoint()
+            crawler.concluir_coleta()
+            # Só agora os arquivos estão completos e podem ser exportados
+            self.running = False
+            if self.sink.dropped:
+                self.update_log(f"{self.sink.dropped} veículos descartados por fila cheia.", 'warning')
+            self.save_diagnostics(crawler, profiler)
+
+    def save_diagnostics(self, crawler, profiler):
+        # Trace e perfil ficam ao lado dos arquivos de saída
+        basename = os.path.splitext(self.csv_filename)[0]
+        try:
+            if crawler.tracer.enabled:
+                trace_file = crawler.tracer.export(f"{basename}.trace.json")
+                self.update_log(f"Trace salvo em {trace_file}", 'info')
+            profile_file = profiler.stop(basename)
+            if profile_file:
+                self.update_log(f"Perfil salvo em {profile_file}", 'info')
+        except Exception as e:
+            self.update_log(f"Erro ao salvar diagnósticos: {str(e)}", 'error')
+
+    def create_sink(self, config):
+        writer = GUIVehicleWriter(self, TabularFileWriter(
+            self.csv_filename,
+            self.excel_filename,
+            self.headers,
+            excel_every=config.get('sink_excel_every', 10),
+            snapshot_dir=self.snapshot_dir
+        ))
+        return BackgroundSink.from_config(writer, config, tracer=self.tracer)
 
     def stop_crawler(self):
         if self.running:
-            self.running = False
+            self.control.stop()
             self.update_log("Coleta interrompida pelo usuário!", 'warning')
 
+    def toggle_pause(self):
+        if not self.running:
+            return
+        if self.control.paused:
+            self.control.resume()
+            self.pause_btn.configure(text="Pausar")
+            self.update_log("Coleta retomada.", 'info')
+        else:
+            self.control.pause()
+            self.pause_btn.configure(text="Retomar")
+            self.update_log("Coleta pausada.", 'warning')
+
     def validate_selection(self):
         ano = self.ano_combo.get()
         mes = self.mes_combo.get()
@@ -462,74 +1031,177 @@ class FipeGUI(tk.Tk):
             return False
         return True
 
+    def current_snapshot(self):
+        """
+        Snapshot da execução carregada ou, terminada a coleta, o da coleta atual.
+        """
+        if self.snapshot is None and not self.running and self.snapshot_dir and (
+            os.path.exists(os.path.join(self.snapshot_dir, 'meta.json'))
+        ):
+            self.snapshot = Snapshot.open(self.snapshot_dir)
+        return self.snapshot
+
+    def export_from_snapshot(self, snapshot, method, filename):
+        # Exporta a partir das colunas mapeadas, sem reler CSV/XLSX, fora da thread do Tk.
+        # Grava em um arquivo próprio: o CSV/XLSX original da coleta nunca é sobrescrito
+        base, ext = os.path.splitext(filename)
+        filename = f"{base}_exportado{ext}"
+
+        def worker():
+            try:
+                getattr(snapshot, method)(filename)
+                self.update_log(f"Dados exportados para {filename}", 'success')
+            except Exception as e:
+                self.update_log(f"Erro ao exportar {filename}: {str(e)}", 'error')
+        threading.Thread(target=worker, daemon=True).start()
+
+    def export_running(self):
+        # Durante a coleta o sink ainda grava nos arquivos; exportar agora leria um lote pela metade
+        if self.running:
+            messagebox.showwarning("Aviso", "Aguarde o fim da coleta para exportar.")
+        return self.running
+
     def export_csv(self):
-        # Gera o CSV com todos os dados acumulados somente quando o botão é clicado.
-        if not self.veiculos:
+        if self.export_running():
+            return
+        snapshot = self.current_snapshot()
+        if snapshot is not None:
+            self.export_from_snapshot(snapshot, 'to_csv', self.csv_filename)
+            return
+        # O CSV já foi gravado em lotes pelo sink.
+        if not self.csv_filename or not os.path.exists(self.csv_filename):
             messagebox.showwarning("Aviso", "Nenhum dado para exportar!")
             return
-        df = pd.DataFrame(self.veiculos)
+        import pandas as pd
+        df = pd.read_csv(self.csv_filename)
         df.to_csv(self.csv_filename, index=False)
         self.update_log(f"Dados exportados para {self.csv_filename}", 'success')
 
     def export_excel(self):
-        # O XLSX já é salvo incrementalmente.
-        if not os.path.exists(self.excel_filename):
+        if self.export_running():
+            return
+        snapshot = self.current_snapshot()
+        if snapshot is not None:
+            self.export_from_snapshot(snapshot, 'to_excel', self.excel_filename)
+            return
+        # O XLSX já foi salvo incrementalmente.
+        if not self.excel_filename or not os.path.exists(self.excel_filename):
             messagebox.showwarning("Aviso", "Nenhum dado salvo no XLSX ainda!")
             return
+        import pandas as pd
         df = pd.read_excel(self.excel_filename)
         df.to_excel(self.excel_filename, index=False)
         self.update_log(f"Dados exportados para {self.excel_filename}", 'success')
 
+    def load_run(self):
+        # Reabre uma execução anterior pelo snapshot colunar, sem ler o XLSX
+        if self.running:
+            messagebox.showwarning("Aviso", "Aguarde o fim da coleta em andamento.")
+            return
+        path = filedialog.askopenfilename(
+            title="Selecione o snapshot da execução (meta.json)",
+            filetypes=[("Snapshot FIPE", "meta.json")]
+        )
+        if not path:
+            return
+        try:
+            snapshot = Snapshot.open(path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Erro", f"Snapshot inválido: {str(e)}")
+            return
+        basename = os.path.splitext(snapshot.path.rstrip('/\\'))[0]
+        self.snapshot = snapshot
+        self.snapshot_dir = snapshot.path
+        self.csv_filename = snapshot.meta.get('csv') or f"{basename}.csv"
+        self.excel_filename = snapshot.meta.get('xlsx') or f"{basename}.xlsx"
+        self.clear_table()
+        for batch in snapshot.iter_batches():
+            self.tree_queue.put(batch)
+        self.update_log(f"Execução carregada de {snapshot.path}: {len(snapshot)} veículos.", 'success')
+
+    def clear_table(self):
+        # Reanexa as linhas ocultas pelo filtro para removê-las junto com as demais
+        self.tree.set_children('', *(f"r{row_id}" for row_id in range(len(self.result_index))))
+        self.tree.delete(*self.tree.get_children())
+        self.result_index = ResultIndex()
+        self.apply_filter()
+
+    def export_change_feed(self):
+        # Variação entre a coleta atual e um export anterior escolhido pelo usuário
+        if not self.csv_filename or not os.path.exists(self.csv_filename):
+            messagebox.showwarning("Aviso", "Nenhum dado para comparar!")
+            return
+        anterior = filedialog.askopenfilename(
+            title="Selecione a tabela anterior",
+            filetypes=[("Exports FIPE", "*.csv *.xlsx")]
+        )
+        if not anterior:
+            return
+        saida = f"{os.path.splitext(self.csv_filename)[0]}_variacao.csv"
+
+        def worker():
+            from change_feed import compute_change_feed
+            try:
+                counts = compute_change_feed(anterior, self.csv_filename, saida)
+                self.update_log(
+                    f"Variação salva em {saida}: {counts['novo']} novos, {counts['removido']} removidos, "
+                    f"{counts['reprecificado']} reprecificados.",
+                    'success'
+                )
+            except Exception as e:
+                self.update_log(f"Erro ao gerar variação: {str(e)}", 'error')
+        threading.Thread(target=worker, daemon=True).start()
+
     def gui_callback(self, action, *args):
         if action == 'update_log':
             self.update_log(*args)
-        elif action == 'save_vehicle':
-            self.save_vehicle_data(args[0])
         elif action == 'update_current_vehicle':
             self.update_current_vehicle(*args)
+        elif action == 'update_plan':
+            self.total_plano, self.ja_processados = args
+            self.inicio_execucao = datetime.now()
 
-    def save_vehicle_data(self, data):
+    def process_tree_queue(self):
+        # Insere na Treeview, pela thread do Tk, as linhas gravadas pelo sink
+        inserted = False
         try:
-            self.veiculos.append(data)
-            self.veiculos_processados += 1
-
-            # Insere os dados na Treeview (sem "anoref")
-            ano_mod = "0 KM" if data['anomod'] == 3200 else data['anomod']
-            valor_formatado = format_currency(data['valor'])
-            self.tree.insert('', 'end', values=(
-                data['marca'], data['modelo'], ano_mod, data['comb_sigla'], valor_formatado
-            ))
-            # Auto-scroll: mostra sempre a última linha
-            children = self.tree.get_children()
-            if children:
-                self.tree.see(children[-1])
-
-            # Salva incrementalmente o XLSX a cada 10 veículos novos (sem limpar self.veiculos)
-            if (len(self.veiculos) - self.xlsx_saved_count) >= 10:
-                new_batch = self.veiculos[self.xlsx_saved_count:]
-                try:
-                    if not os.path.exists(self.excel_filename):
-                        pd.DataFrame(new_batch).to_excel(self.excel_filename, index=False)
-                    else:
-                        df_existente = pd.read_excel(self.excel_filename)
-                        df_new = pd.DataFrame(new_batch)
-                        df_completo = pd.concat([df_existente, df_new], ignore_index=True)
-                        df_completo.to_excel(self.excel_filename, index=False)
-                    self.xlsx_saved_count = len(self.veiculos)
-                    self.update_log("Lote de 10 veículos gravado no XLSX com sucesso.", 'success')
-                except Exception as e:
-                    self.update_log(f"Erro ao salvar XLSX: {str(e)}", 'error')
-        except Exception as e:
-            self.update_log(f"Erro ao salvar dados: {str(e)}", 'error')
+            while True:
+                for data in self.tree_queue.get_nowait():
+                    ano_mod = "0 KM" if data['anomod'] == 3200 else data['anomod']
+                    valor_formatado = format_currency(data['valor'])
+                    row_id = self.result_index.add(data)
+                    iid = self.tree.insert('', 'end', iid=f"r{row_id}", values=(
+                        data['marca'], data['modelo'], ano_mod, data['comb_sigla'], valor_formatado
+                    ))
+                    if self.filtro is not None and not self.result_index.matches(row_id, **self.filtro):
+                        self.tree.detach(iid)
+                    inserted = True
+        except queue.Empty:
+            pass
+        finally:
+            if inserted:
+                # Auto-scroll: mostra sempre a última linha
+                children = self.tree.get_children()
+                if children:
+                    self.tree.see(children[-1])
+                self.update_filter_label()
+            self.after(200, self.process_tree_queue)
 
     def on_close(self):
         if self.running:
             if messagebox.askokcancel("Sair", "A coleta está em andamento. Deseja realmente sair?"):
                 self.stop_crawler()
-                self.destroy()
+                self.wait_worker_and_destroy(datetime.now() + timedelta(seconds=30))
         else:
             self.destroy()
 
+    def wait_worker_and_destroy(self, deadline):
+        # Espera (sem travar o Tk) a coleta salvar checkpoint e descarregar o sink
+        if self.worker and self.worker.is_alive() and datetime.now() < deadline:
+            self.after(100, lambda: self.wait_worker_and_destroy(deadline))
+            return
+        self.destroy()
+
     def get_selected_table(self):
         selected_ano = self.ano_combo.get()
         selected_mes = self.mes_combo.get().split(' ')[0]
@@ -546,19 +1218,269 @@ class FipeGUI(tk.Tk):
             dias = tempo_decorrido.days
             horas, resto = divmod(tempo_decorrido.seconds, 3600)
             minutos, segundos = divmod(resto, 60)
-            if self.veiculos_processados > 0:
-                tempo_total_seg = tempo_decorrido.total_seconds()
-                velocidade = (self.veiculos_processados / tempo_total_seg) * 3600
+            if self.veiculos_processados > 0 and self.inicio_execucao:
+                # A taxa conta só a execução: o planejamento são requisições de catálogo
+                tempo_execucao_seg = max((datetime.now() - self.inicio_execucao).total_seconds(), 1e-6)
+                velocidade = (self.veiculos_processados / tempo_execucao_seg) * 3600
             else:
                 velocidade = 0.0
+            concluidos = self.ja_processados + self.veiculos_processados
+            if self.total_plano:
+                restantes = max(self.total_plano - concluidos, 0)
+                eta = str(timedelta(seconds=int(restantes / velocidade * 3600))) if velocidade else "--"
+                progresso = f"{concluidos:,.0f}/{self.total_plano:,.0f}     ETA: {eta}"
+            else:
+                progresso = f"{self.veiculos_processados:,.0f}"
             self.progress_label['text'] = (
-                f"Veículos processados: {self.veiculos_processados:,.0f}     "
+                f"Veículos processados: {progresso}     "
                 f"Tempo de Execução: {dias:02d}d {horas:02d}h {minutos:02d}m {segundos:02d}s     "
                 f"Velocidade de processamento: {velocidade:.2f} veículos/hora"
             )
         self.after(1000, self.update_tempo_execucao)
 
+async def run_headless(crawler, sink, tabela_id=None, tipos=(1,), codigos=None, shard=None):
+    """
+    Executa uma coleta sem GUI, enviando os veículos ao sink.
+    Sem `tabela_id`, usa a tabela de referência mais recente.
+    Retorna (veículos coletados, coleta completa).
+    """
+    import aiohttp
+    total = 0
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=50)) as session:
+        if tabela_id is None:
+            tabelas = await crawler.extract_tabelas(session)
+            if not tabelas:
+                logger.error("Não foi possível obter as tabelas de referência.")
+                return 0, False
+            tabela_id = max(int(t['id']) for t in tabelas)
+        if codigos:
+            veiculos = crawler.iter_veiculos_por_codigo(session, tabela_id, codigos, tipos)
+        else:
+            veiculos = crawler.iter_veiculos(session, tabela_id, tipos, shard)
+        try:
+            async for veiculo in veiculos:
+                if await sink.put_async(veiculo, crawler.confirmacao()):
+                    total += 1
+        finally:
+            # Os veículos só são marcados como processados quando o sink os grava
+            await asyncio.to_thread(sink.close)
+            crawler.save_checkpoint()
+    completo = crawler.concluir_coleta() and not sink.dropped and not sink.failed
+    logger.info(f"Tabela {tabela_id}: {total} veículos coletados.")
+    return total, completo
+
+async def estimate_job(crawler, tabela_id=None, tipos=(1,), shard=None):
+    """
+    Custo previsto de uma coleta antes de executá-la. Monta (ou reaproveita)
+    o plano, o que só consome requisições de catálogo na primeira vez.
+    """
+    import aiohttp
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=50)) as session:
+        if tabela_id is None:
+            tabelas = await crawler.extract_tabelas(session)
+            if not tabelas:
+                logger.error("Não foi possível obter as tabelas de referência.")
+                return None
+            tabela_id = max(int(t['id']) for t in tabelas)
+        plano = await crawler.planejar(session, tabela_id, tipos)
+    pendentes = sum(1 for _ in plano.work(crawler.processed, shard))
+    custo = plano.estimate(pendentes, crawler.config.get('rate_limit_refill', 1))
+    logger.info(crawler.describe_estimate(custo))
+    return custo
+
+def run_job(crawler, tabela_id=None, tipos=(1,), codigos=None, shard=None, basename=None):
+    """
+    Coleta sem GUI gravando CSV/XLSX pelo sink, com trace e perfil opcionais.
+    Com `basename` de uma tentativa anterior, continua nos mesmos arquivos.
+    Retorna {'csv', 'total', 'completo'}; 'csv' é None se nada foi gravado.
+    """
+    basename = basename or f"FIPE_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    sink = BackgroundSink.from_config(TabularFileWriter(
+        f"{basename}.csv",
+        f"{basename}.xlsx",
+        HEADERS,
+        excel_every=crawler.config.get('sink_excel_every', 10),
+        snapshot_dir=f"{basename}.snap"
+    ), crawler.config, tracer=crawler.tracer)
+    profiler = Profiler(crawler.config.get('profile'))
+    profiler.start()
+    try:
+        total, completo = asyncio.run(run_headless(crawler, sink, tabela_id, tipos, codigos, shard))
+    finally:
+        sink.close()
+        profiler.stop(basename)
+        if crawler.tracer.enabled:
+            crawler.tracer.export(f"{basename}.trace.json")
+    csv_filename = f"{basename}.csv" if os.path.exists(f"{basename}.csv") else None
+    if not completo:
+        logger.warning(f"Coleta parcial ou vazia ({total} veículos nesta execução); execute novamente para completar.")
+    return {'csv': csv_filename, 'total': total, 'completo': completo}
+
+async def poll_latest_table(crawler, state):
+    """
+    Consulta barata da tabela de referência mais recente. Usa ETag quando o
+    servidor envia e compara o hash da resposta, sem passar pelo cache do
+    http_post. Retorna {'codigo', 'etag', 'hash'}, ou None se nada mudou.
+
+    Não altera `state`: ETag e hash só são registrados pelo chamador depois
+    que a tabela nova foi coletada, para que uma falha seja retentada.
+    """
+    import aiohttp
+    headers = dict(crawler.headers)
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    timeout = aiohttp.ClientTimeout(total=crawler.config.get('timeout', 20))
+    if await asyncio.to_thread(crawler.budget.reserve, 'tabelas'):
+        logger.warning("Orçamento de requisições esgotado; consulta de tabelas adiada.")
+        return None
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await crawler.rate_limiter.acquire()
+        async with session.post(crawler.urls['tabelas'], data={}, headers=headers) as response:
+            if response.status == 304:
+                return None
+            response.raise_for_status()
+            body = await response.read()
+            etag = response.headers.get('ETag')
+    digest = hashlib.sha1(body).hexdigest()
+    if digest == state.get('hash'):
+        return None
+    codigos = [int(t['Codigo']) for t in json.loads(body) if 'Codigo' in t]
+    if not codigos:
+        return None
+    return {'codigo': max(codigos), 'etag': etag, 'hash': digest}
+
+def load_watch_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_watch_state(path, state):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+def watch_tables(crawler, tipos):
+    """
+    Modo daemon: consulta periodicamente a lista de tabelas e, quando surge uma
+    nova, coleta os tipos configurados e gera o feed de variação contra a
+    coleta anterior. Nos primeiros dias do mês (quando as tabelas saem) a
+    consulta é mais frequente.
+    """
+    from change_feed import compute_change_feed
+    config = crawler.config
+    state_file = config.get('watch_state_file', 'fipe_watch.json')
+    state = load_watch_state(state_file)
+    logger.info(f"Monitorando novas tabelas (última conhecida: {state.get('tabela_id')}).")
+    while True:
+        try:
+            consulta = asyncio.run(poll_latest_table(crawler, state))
+            latest = consulta['codigo'] if consulta else None
+            if latest is not None and state.get('tabela_id') is None:
+                # Primeira execução: só registra a referência, sem coletar
+                state.update(tabela_id=latest, etag=consulta['etag'], hash=consulta['hash'])
+                save_watch_state(state_file, state)
+                logger.info(f"Tabela atual registrada como referência: {latest}")
+            elif latest is not None and latest > state['tabela_id']:
+                # Uma tentativa interrompida da mesma tabela continua nos mesmos arquivos
+                andamento = state.get('em_andamento') or {}
+                if andamento.get('tabela_id') != latest:
+                    andamento = {'tabela_id': latest, 'basename': f"FIPE_{datetime.now().strftime('%Y%m%d_%H%M%S')}"}
+                    state['em_andamento'] = andamento
+                    save_watch_state(state_file, state)
+                logger.info(f"Nova tabela de referência publicada: {latest}. Iniciando coleta.")
+                resultado = run_job(crawler, latest, tipos, basename=andamento['basename'])
+                if not resultado['completo'] or not resultado['csv']:
+                    # ETag/hash não são gravados: a próxima consulta tenta de novo
+                    raise RuntimeError(f"coleta da tabela {latest} incompleta; será retomada")
+                csv_filename = resultado['csv']
+                if state.get('ultimo_csv') and os.path.exists(state['ultimo_csv']):
+                    compute_change_feed(
+                        state['ultimo_csv'], csv_filename,
+                        f"{os.path.splitext(csv_filename)[0]}_variacao.csv"
+                    )
+                if config.get('history_file'):
+                    from history import PriceHistory
+                    PriceHistory.load(config['history_file']).append_table(csv_filename)
+                state.pop('em_andamento', None)
+                state.update(
+                    tabela_id=latest, ultimo_csv=csv_filename, coletado_em=datetime.now().isoformat(),
+                    etag=consulta['etag'], hash=consulta['hash']
+                )
+                save_watch_state(state_file, state)
+            elif consulta is not None:
+                # Lista mudou sem tabela nova: registra para pular a próxima consulta igual
+                state.update(etag=consulta['etag'], hash=consulta['hash'])
+                save_watch_state(state_file, state)
+        except Exception as e:
+            logger.error(f"Falha no monitoramento: {str(e)}")
+        if datetime.now().day <= config.get('watch_dias_inicio_mes', 10):
+            interval = config.get('watch_interval_inicio_mes', 300)
+        else:
+            interval = config.get('watch_interval', 3600)
+        sleep(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coletor de Dados FIPE")
+    parser.add_argument('--codigos', help="arquivo com um CodigoFipe por linha (modo direcionado, sem GUI)")
+    parser.add_argument('--tabela', type=int, help="código da tabela de referência (padrão: a mais recente)")
+    parser.add_argument('--tipos', type=int, nargs='+',
+                        help="tipos de veículo (1, 2, 3); padrão 1, ou watch_tipos no --watch")
+    parser.add_argument('--coletar', action='store_true', help="coleta completa da tabela, sem GUI")
+    parser.add_argument('--shard', help="parte do plano a executar, no formato i/n (ex.: 0/4)")
+    parser.add_argument('--variacao', nargs=2, metavar=('ANTERIOR', 'ATUAL'),
+                        help="gera o feed de variação entre dois exports (CSV/XLSX) e sai")
+    parser.add_argument('--saida', help="arquivo do feed de variação (padrão: <ATUAL>_variacao.csv)")
+    parser.add_argument('--watch', action='store_true',
+                        help="modo daemon: coleta automaticamente cada nova tabela de referência")
+    parser.add_argument('--estimar', action='store_true',
+                        help="mostra o custo previsto em requisições da coleta e sai")
+    parser.add_argument('--consumo', nargs='?', const=datetime.now().strftime('%Y-%m-%d'), metavar='DIA',
+                        help="mostra as requisições registradas por endpoint e tabela (padrão: hoje) e sai")
+    args = parser.parse_args(argv)
+
+    if args.variacao:
+        from change_feed import compute_change_feed
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+        anterior, atual = args.variacao
+        compute_change_feed(anterior, atual, args.saida or f"{os.path.splitext(atual)[0]}_variacao.csv")
+        return
+
+    shard = None
+    if args.shard:
+        i, n = (int(p) for p in args.shard.split('/'))
+        if not 0 <= i < n:
+            parser.error("--shard deve ser i/n com 0 <= i < n")
+        shard = (i, n)
+
+    if not (args.codigos or args.coletar or args.watch or args.estimar or args.consumo):
+        app = FipeGUI()
+        app.after(1000, app.update_tempo_execucao)
+        app.mainloop()
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    codigos = None
+    if args.codigos:
+        with open(args.codigos, encoding='utf-8') as f:
+            codigos = [linha.strip() for linha in f if linha.strip()]
+    crawler = FipeSyncCrawler()
+    # --tipos explícito vale sobre o config; sem ele, --watch usa watch_tipos
+    tipos = args.tipos or (crawler.config.get('watch_tipos', [1]) if args.watch else [1])
+    if args.consumo:
+        for linha in crawler.budget.usage(args.consumo, args.tabela):
+            print(f"{linha['dia']}  {linha['endpoint']:<12} tabela {linha['tabela_id']:<6} {linha['total']}")
+        return
+    if args.estimar:
+        asyncio.run(estimate_job(crawler, args.tabela, tipos, shard))
+        return
+    if args.watch:
+        try:
+            watch_tables(crawler, tipos)
+        except KeyboardInterrupt:
+            logger.info("Monitoramento encerrado.")
+        return
+    run_job(crawler, args.tabela, tipos, codigos, shard)
+
 if __name__ == "__main__":
-    app = FipeGUI()
-    app.after(1000, app.update_tempo_execucao)
-    app.mainloop()
+    main()
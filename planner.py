@@ -0,0 +1,113 @@
+import os
+import json
+import zlib
+import logging
+from datetime import datetime
+from itertools import zip_longest
+
+PLAN_DIR = 'planos'
+logger = logging.getLogger(__name__)
+
+
+class CrawlPlan:
+    """
+    Plano de coleta de uma tabela: a lista completa de (tipo, marca, modelo, ano)
+    a precificar, montada antes da execução e persistida em disco.
+
+    Como uma tabela de referência não muda depois de publicada, o plano é
+    reaproveitado ao retomar a coleta e dá totais e ETA exatos.
+    """
+    def __init__(self, tabela_id, tipos, items=None, created=None):
+        self.tabela_id = int(tabela_id)
+        self.tipos = sorted(int(t) for t in tipos)
+        # Cada item: [tipo, marca_id, marca_label, modelo_id, modelo_label, ano_value, ano_label]
+        self.items = items or []
+        self.created = created or datetime.now().isoformat()
+        # Só planos montados de um catálogo sem falhas são salvos (e recarregados)
+        self.completo = True
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def path_for(tabela_id, tipos, plan_dir=PLAN_DIR):
+        tipos = '-'.join(str(t) for t in sorted(int(t) for t in tipos))
+        return os.path.join(plan_dir, f"plano_{int(tabela_id)}_{tipos}.json")
+
+    def add(self, tipo, marca, modelo, ano):
+        self.items.append([
+            int(tipo),
+            marca['Value'], marca.get('Label'),
+            modelo['Value'], modelo.get('Label'),
+            ano['Value'], ano.get('Label')
+        ])
+
+    def work(self, processed=None, shard=None):
+        """
+        Gera (tipo, marca, modelo, ano) no formato do crawler, pulando o que já
+        consta em `processed` e, se `shard=(i, n)`, o que não pertence ao shard i.
+        """
+        for item in self.items:
+            tipo, marca_id, marca_label, modelo_id, modelo_label, ano_value, ano_label = item
+            if shard and self.shard_of(item, shard[1]) != shard[0]:
+                continue
+            marca = {'Value': marca_id, 'Label': marca_label}
+            modelo = {'Value': modelo_id, 'Label': modelo_label}
+            ano = {'Value': ano_value, 'Label': ano_label}
+            if processed is not None and processed.contains(
+                self.tabela_id, f"{tipo}-{marca_id}-{modelo_id}-{ano_value}"
+            ):
+                continue
+            yield tipo, marca, modelo, ano
+
+    @staticmethod
+    def shard_of(item, shards):
+        # Hash estável do modelo: todos os anos de um modelo caem no mesmo shard
+        return zlib.crc32(f"{item[0]}-{item[1]}-{item[3]}".encode('utf-8')) % shards
+
+    def interleave(self):
+        """
+        Reordena os itens alternando entre marcas, para que a concorrência não
+        fique concentrada em uma única marca (e numa eventual lentidão dela).
+        """
+        por_marca = {}
+        for item in self.items:
+            por_marca.setdefault((item[0], item[1]), []).append(item)
+        self.items = [
+            item
+            for rodada in zip_longest(*por_marca.values())
+            for item in rodada if item is not None
+        ]
+
+    def estimate(self, pending, refill_rate):
+        """Custo previsto da execução: uma requisição por veículo pendente."""
+        refill_rate = refill_rate or 1
+        return {
+            'veiculos': len(self.items),
+            'pendentes': pending,
+            'requisicoes': pending,
+            'segundos': pending / refill_rate
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'tabela_id': self.tabela_id,
+                'tipos': self.tipos,
+                'created': self.created,
+                'items': self.items
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+        logger.info(f"Plano com {len(self.items)} itens salvo em {path}")
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError) as e:
+            logger.info(f"Plano não encontrado ou inválido ({path}): {str(e)}")
+            return None
+        return cls(state['tabela_id'], state['tipos'], state['items'], state.get('created'))
@@ -0,0 +1,326 @@
+"""
+Serviço HTTP somente leitura de consulta de preços sobre os dados coletados.
+
+Rotas (todas GET, respostas em JSON):
+  /preco?fipe_cod=001004-9[&anomod=2020]        um código (todos os anos, ou um)
+  /precos?codigo=001004-9:2020&codigo=004001-0  vários códigos por chamada
+  /modelo?marca=Fiat[&modelo=uno]               por marca e prefixo do modelo
+  /faixa?min=30000&max=45000[&limite=100]       por faixa de preço
+  /status                                       tabela carregada
+POST /precos aceita {"codigos": ["001004-9", ["004001-0", 2020], ...]}.
+
+Uso: python price_service.py --arquivo FIPE_x.csv   (ou FIPE_x.snap)
+     python price_service.py --estado fipe_watch.json   (recarrega a cada nova coleta)
+"""
+import os
+import csv
+import json
+import bisect
+import logging
+import argparse
+import threading
+from time import sleep
+from array import array
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from result_index import normalize_text
+from settings import load_settings
+
+logger = logging.getLogger(__name__)
+
+
+class PriceTable:
+    """
+    Registros de uma coleta em colunas compactas (arrays numéricos e strings
+    internadas), com os índices montados uma vez na carga:
+
+    - hash fipe_cod -> linhas;
+    - lista ordenada (marca, modelo) para busca por marca e prefixo do modelo;
+    - lista ordenada de preços para consultas por faixa.
+
+    É imutável depois de montada: a troca por uma tabela nova é só a troca
+    da referência no serviço.
+    """
+    def __init__(self, origem):
+        self.origem = origem
+        self.carregado_em = datetime.now().isoformat()
+        self.fipe_cod = []
+        self.marca = []
+        self.modelo = []
+        self.comb_sigla = []
+        self.tabela_id = array('i')
+        self.anomod = array('i')
+        self.comb_cod = array('i')
+        self.valor = array('d')
+        self.por_codigo = {}
+        self._modelos = []
+        self._precos = []
+        self._ordem_precos = array('i')
+        self._strings = {}
+
+    def __len__(self):
+        return len(self.valor)
+
+    @staticmethod
+    def _int(value):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return 0
+
+    def append(self, record):
+        intern = lambda s: self._strings.setdefault(s, s)
+        self.fipe_cod.append(intern(str(record.get('fipe_cod') or '').strip()))
+        self.marca.append(intern(record.get('marca') or ''))
+        self.modelo.append(intern(record.get('modelo') or ''))
+        self.comb_sigla.append(intern(record.get('comb_sigla') or ''))
+        self.tabela_id.append(self._int(record.get('tabela_id')))
+        self.anomod.append(self._int(record.get('anomod')))
+        self.comb_cod.append(self._int(record.get('comb_cod')))
+        try:
+            self.valor.append(float(record.get('valor') or 0.0))
+        except ValueError:
+            self.valor.append(0.0)
+
+    def build(self):
+        """Monta os índices. Chamado uma vez, depois de todos os append."""
+        por_codigo = {}
+        for row, codigo in enumerate(self.fipe_cod):
+            por_codigo.setdefault(codigo, []).append(row)
+        self.por_codigo = por_codigo
+        self._modelos = sorted(
+            (normalize_text(marca), normalize_text(modelo), row)
+            for row, (marca, modelo) in enumerate(zip(self.marca, self.modelo))
+        )
+        ordem = sorted(range(len(self.valor)), key=self.valor.__getitem__)
+        self._ordem_precos = array('i', ordem)
+        self._precos = [self.valor[row] for row in ordem]
+        self._strings = {}
+        return self
+
+    @classmethod
+    def from_csv(cls, filename):
+        table = cls(filename)
+        with open(filename, newline='', encoding='utf-8') as f:
+            for record in csv.DictReader(f):
+                table.append(record)
+        return table.build()
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """Carrega as colunas direto do snapshot colunar, sem passar por dicts."""
+        from snapshot import Snapshot
+        snapshot = Snapshot.open(path)
+        table = cls(snapshot.path)
+        strings = snapshot.strings
+        cols = snapshot.columns
+        for name in ('fipe_cod', 'marca', 'modelo', 'comb_sigla'):
+            setattr(table, name, [strings[code] for code in cols[name].tolist()])
+        table.fipe_cod = [codigo.strip() for codigo in table.fipe_cod]
+        for name in ('tabela_id', 'anomod', 'comb_cod'):
+            setattr(table, name, array('i', cols[name].astype('<i4').tobytes()))
+        table.valor = array('d', cols['valor'].astype('<f8').tobytes())
+        return table.build()
+
+    @classmethod
+    def from_records(cls, records, origem='memória'):
+        table = cls(origem)
+        for record in records:
+            table.append(record)
+        return table.build()
+
+    def record(self, row):
+        return {
+            'tabela_id': self.tabela_id[row],
+            'fipe_cod': self.fipe_cod[row],
+            'marca': self.marca[row],
+            'modelo': self.modelo[row],
+            'anomod': self.anomod[row],
+            'comb_cod': self.comb_cod[row],
+            'comb_sigla': self.comb_sigla[row],
+            'valor': self.valor[row],
+        }
+
+    def by_code(self, fipe_cod, anomod=None):
+        rows = self.por_codigo.get(str(fipe_cod).strip(), ())
+        if anomod is not None:
+            rows = [row for row in rows if self.anomod[row] == int(anomod)]
+        return [self.record(row) for row in rows]
+
+    def by_codes(self, codigos):
+        """Consulta em lote: cada item é um fipe_cod ou um par (fipe_cod, anomod)."""
+        resultado = {}
+        for item in codigos:
+            if isinstance(item, (list, tuple)):
+                fipe_cod, anomod = item[0], (item[1] if len(item) > 1 else None)
+            else:
+                fipe_cod, _, anomod = str(item).partition(':')
+                anomod = anomod or None
+            chave = f"{fipe_cod}:{anomod}" if anomod is not None else str(fipe_cod)
+            resultado[chave] = self.by_code(fipe_cod, anomod)
+        return resultado
+
+    def by_model(self, marca, modelo=None, limite=None):
+        marca = normalize_text(marca)
+        modelo = normalize_text(modelo) if modelo else ''
+        inicio = bisect.bisect_left(self._modelos, (marca, modelo))
+        rows = []
+        for m, mod, row in self._modelos[inicio:]:
+            if m != marca or not mod.startswith(modelo):
+                break
+            rows.append(row)
+            if limite and len(rows) >= limite:
+                break
+        return [self.record(row) for row in rows]
+
+    def by_price(self, preco_min=None, preco_max=None, limite=100):
+        inicio = 0 if preco_min is None else bisect.bisect_left(self._precos, preco_min)
+        fim = len(self._precos) if preco_max is None else bisect.bisect_right(self._precos, preco_max)
+        if limite:
+            fim = min(fim, inicio + limite)
+        return [self.record(row) for row in self._ordem_precos[inicio:fim]]
+
+    def status(self):
+        tabelas = sorted(set(self.tabela_id))
+        return {
+            'origem': self.origem,
+            'carregado_em': self.carregado_em,
+            'registros': len(self),
+            'tabelas': tabelas,
+        }
+
+
+class PriceService:
+    """
+    Mantém a tabela ativa e a troca atomicamente: a nova é montada por
+    inteiro fora do caminho das consultas e só então a referência é trocada.
+    Cada requisição lê `table` uma única vez e usa essa versão até o fim.
+    """
+    def __init__(self, table=None):
+        self.table = table if table is not None else PriceTable.from_records([], origem=None)
+        self._server = None
+
+    def swap(self, table):
+        anterior, self.table = self.table, table
+        logger.info(f"Tabela de preços trocada: {anterior.origem} -> {table.origem} ({len(table)} registros)")
+
+    def load(self, filename):
+        """Carrega um CSV ou, de preferência, o snapshot colunar da mesma coleta."""
+        snapshot_dir = f"{os.path.splitext(filename)[0]}.snap" if filename.endswith('.csv') else filename
+        if os.path.exists(os.path.join(snapshot_dir, 'meta.json')):
+            self.swap(PriceTable.from_snapshot(snapshot_dir))
+        else:
+            self.swap(PriceTable.from_csv(filename))
+
+    def follow(self, state_file, interval=30):
+        """
+        Acompanha o estado do modo --watch e recarrega quando uma nova coleta
+        termina (campo `ultimo_csv`). Roda em thread daemon.
+        """
+        def loop():
+            atual = None
+            while True:
+                try:
+                    with open(state_file, encoding='utf-8') as f:
+                        ultimo = json.load(f).get('ultimo_csv')
+                    if ultimo and ultimo != atual and os.path.exists(ultimo):
+                        self.load(ultimo)
+                        atual = ultimo
+                except (FileNotFoundError, ValueError):
+                    pass
+                except Exception as e:
+                    logger.error(f"Falha ao recarregar a tabela de preços: {str(e)}")
+                sleep(interval)
+        thread = threading.Thread(target=loop, name='price-service-follow', daemon=True)
+        thread.start()
+        return thread
+
+    def serve(self, host='127.0.0.1', port=8765):
+        self._server = ThreadingHTTPServer((host, port), PriceRequestHandler)
+        self._server.service = self
+        self._server.daemon_threads = True
+        logger.info(f"Serviço de preços em http://{host}:{port}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class PriceRequestHandler(BaseHTTPRequestHandler):
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        table = self.server.service.table
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        arg = lambda nome: query.get(nome, [None])[0]
+        try:
+            if url.path == '/preco' and arg('fipe_cod'):
+                self._send(200, table.by_code(arg('fipe_cod'), arg('anomod')))
+            elif url.path == '/precos':
+                self._send(200, table.by_codes(query.get('codigo', []) + query.get('fipe_cod', [])))
+            elif url.path == '/modelo' and arg('marca'):
+                limite = int(arg('limite')) if arg('limite') else None
+                self._send(200, table.by_model(arg('marca'), arg('modelo'), limite))
+            elif url.path == '/faixa':
+                preco = lambda nome: float(arg(nome)) if arg(nome) else None
+                self._send(200, table.by_price(preco('min'), preco('max'), int(arg('limite') or 100)))
+            elif url.path == '/status':
+                self._send(200, table.status())
+            else:
+                self._send(404, {'erro': 'rota ou parâmetros inválidos'})
+        except ValueError as e:
+            self._send(400, {'erro': str(e)})
+
+    def do_POST(self):
+        table = self.server.service.table
+        if urlparse(self.path).path != '/precos':
+            self._send(404, {'erro': 'rota inválida'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            self._send(200, table.by_codes(payload.get('codigos', [])))
+        except (ValueError, AttributeError) as e:
+            self._send(400, {'erro': str(e)})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def main(argv=None):
+    config = load_settings()
+    parser = argparse.ArgumentParser(description="Serviço de consulta de preços FIPE")
+    parser.add_argument('--arquivo', help="CSV ou snapshot (.snap) de uma coleta")
+    parser.add_argument('--estado', default=config.get('watch_state_file', 'fipe_watch.json'),
+                        help="estado do modo --watch; recarrega a cada nova coleta")
+    parser.add_argument('--host', default=config.get('price_service_host', '127.0.0.1'))
+    parser.add_argument('--porta', type=int, default=config.get('price_service_port', 8765))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    service = PriceService()
+    if args.arquivo:
+        service.load(args.arquivo)
+    else:
+        service.follow(args.estado, config.get('price_service_poll', 30))
+    try:
+        service.serve(args.host, args.porta)
+    except KeyboardInterrupt:
+        logger.info("Serviço de preços encerrado.")
+
+
+if __name__ == '__main__':
+    main()
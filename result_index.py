@@ -0,0 +1,121 @@
+import re
+import bisect
+import unicodedata
+from collections import defaultdict
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def normalize_text(text):
+    """Minúsculas e sem acentos, para buscas tolerantes."""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return _TOKEN.findall(normalize_text(text))
+
+
+class ResultIndex:
+    """
+    Índice em memória sobre os veículos coletados, atualizado a cada registro.
+
+    - marca, ano e combustível: índice invertido exato;
+    - modelo: índice de tokens, com vocabulário ordenado para busca por prefixo;
+    - preço: lista ordenada (valor, id) consultada por bisect.
+
+    Os ids são a ordem de inserção, então o resultado já sai na ordem da coleta.
+    """
+    def __init__(self):
+        self.rows = []
+        self.por_marca = defaultdict(list)
+        self.por_ano = defaultdict(list)
+        self.por_comb = defaultdict(list)
+        self.tokens = defaultdict(list)
+        self.vocab = []
+        self.precos = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, record):
+        row_id = len(self.rows)
+        row = (
+            record.get('marca'), record.get('modelo'), record.get('anomod'),
+            record.get('comb_sigla'), float(record.get('valor') or 0.0), record.get('fipe_cod')
+        )
+        self.rows.append(row)
+        marca, modelo, anomod, comb_sigla, valor, _ = row
+        self.por_marca[normalize_text(marca)].append(row_id)
+        self.por_ano[str(anomod)].append(row_id)
+        self.por_comb[str(comb_sigla)].append(row_id)
+        for token in set(tokenize(modelo)):
+            if token not in self.tokens:
+                bisect.insort(self.vocab, token)
+            self.tokens[token].append(row_id)
+        bisect.insort(self.precos, (valor, row_id))
+        return row_id
+
+    def _modelo_ids(self, consulta):
+        # Cada termo da consulta casa como prefixo de algum token do modelo
+        resultado = None
+        for termo in tokenize(consulta):
+            inicio = bisect.bisect_left(self.vocab, termo)
+            ids = set()
+            for token in self.vocab[inicio:]:
+                if not token.startswith(termo):
+                    break
+                ids.update(self.tokens[token])
+            resultado = ids if resultado is None else resultado & ids
+            if not resultado:
+                return set()
+        return resultado
+
+    def _preco_ids(self, preco_min, preco_max):
+        inicio = 0 if preco_min is None else bisect.bisect_left(self.precos, (preco_min, -1))
+        fim = len(self.precos) if preco_max is None else bisect.bisect_right(self.precos, (preco_max, len(self.rows)))
+        return {row_id for _, row_id in self.precos[inicio:fim]}
+
+    def search(self, marca=None, modelo=None, ano=None, comb=None, preco_min=None, preco_max=None):
+        """Retorna os ids que atendem a todos os filtros informados, em ordem de inserção."""
+        candidatos = []
+        if marca:
+            candidatos.append(set(self.por_marca.get(normalize_text(marca), ())))
+        if ano:
+            candidatos.append(set(self.por_ano.get(str(ano), ())))
+        if comb:
+            candidatos.append(set(self.por_comb.get(str(comb), ())))
+        if modelo and tokenize(modelo):
+            candidatos.append(self._modelo_ids(modelo))
+        if preco_min is not None or preco_max is not None:
+            candidatos.append(self._preco_ids(preco_min, preco_max))
+        if not candidatos:
+            return list(range(len(self.rows)))
+        candidatos.sort(key=len)
+        resultado = candidatos[0].intersection(*candidatos[1:])
+        return sorted(resultado)
+
+    def matches(self, row_id, marca=None, modelo=None, ano=None, comb=None, preco_min=None, preco_max=None):
+        """Testa um único registro contra os filtros (usado para linhas recém-chegadas)."""
+        r_marca, r_modelo, r_ano, r_comb, r_valor, _ = self.rows[row_id]
+        if marca and normalize_text(marca) != normalize_text(r_marca):
+            return False
+        if ano and str(ano) != str(r_ano):
+            return False
+        if comb and str(comb) != str(r_comb):
+            return False
+        if modelo:
+            tokens = tokenize(r_modelo)
+            if not all(any(t.startswith(termo) for t in tokens) for termo in tokenize(modelo)):
+                return False
+        if preco_min is not None and r_valor < preco_min:
+            return False
+        if preco_max is not None and r_valor > preco_max:
+            return False
+        return True
+
+    def marcas(self):
+        return sorted({row[0] for row in self.rows if row[0]}, key=normalize_text)
+
+    def combustiveis(self):
+        return sorted(k for k in self.por_comb if k)
@@ -0,0 +1,16 @@
+import yaml
+from functools import lru_cache
+
+CONFIG_FILE = 'config.yaml'
+# O loader em C (libyaml), quando disponível, interpreta o YAML bem mais rápido
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+@lru_cache(maxsize=None)
+def load_settings(path=CONFIG_FILE):
+    """
+    Lê o config.yaml uma única vez por processo. Todos os crawlers recebem o
+    mesmo dicionário, que deve ser tratado como somente leitura.
+    """
+    with open(path, encoding='utf-8') as f:
+        return yaml.load(f, Loader=_Loader)
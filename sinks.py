@@ -0,0 +1,187 @@
+import os
+import queue
+import atexit
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_FIM = object()
+
+
+class BackgroundSink:
+    """
+    Estágio de saída: recebe registros por uma fila limitada e os entrega em
+    lotes ao writer, numa thread própria, fora do event loop do crawler.
+
+    Política de contrapressão:
+      - 'block': o produtor espera até haver espaço na fila;
+      - 'drop': o registro é descartado (e contabilizado) se a fila estiver cheia.
+
+    Cada registro pode levar um `ack`, chamado na thread do sink só depois que
+    o lote dele foi gravado pelo writer. Registros descartados ou de lotes que
+    falharam nunca são confirmados.
+    """
+    def __init__(self, writer, batch_size=50, max_queue=1000, policy='block', flush_interval=2.0, tracer=None):
+        if policy not in ('block', 'drop'):
+            raise ValueError(f"Política de contrapressão inválida: {policy}")
+        self.writer = writer
+        self.batch_size = batch_size
+        self.policy = policy
+        self.flush_interval = flush_interval
+        self.tracer = tracer
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.failed = 0
+        self.written = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='fipe-sink', daemon=True)
+        self._thread.start()
+        # Garante a descarga da fila mesmo se o processo for encerrado sem close()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, writer, config, tracer=None):
+        return cls(
+            writer,
+            batch_size=config.get('sink_batch_size', 50),
+            max_queue=config.get('sink_queue_size', 1000),
+            policy=config.get('sink_backpressure', 'block'),
+            tracer=tracer
+        )
+
+    def put(self, record, ack=None):
+        """Versão síncrona, para produtores em threads comuns."""
+        if self._closed:
+            raise RuntimeError("Sink já encerrado.")
+        if self.policy == 'block':
+            self.queue.put((record, ack))
+            return True
+        try:
+            self.queue.put_nowait((record, ack))
+            return True
+        except queue.Full:
+            self._drop()
+            return False
+
+    async def put_async(self, record, ack=None, backoff=0.05):
+        """Versão para corrotinas: aguarda espaço sem bloquear o event loop."""
+        if self._closed:
+            raise RuntimeError("Sink já encerrado.")
+        while True:
+            try:
+                self.queue.put_nowait((record, ack))
+                return True
+            except queue.Full:
+                if self.policy == 'drop':
+                    self._drop()
+                    return False
+                await asyncio.sleep(backoff)
+
+    def _drop(self):
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.warning(f"Fila de saída cheia: {self.dropped} registros descartados.")
+
+    def _run(self):
+        batch = []
+        fim = False
+        while not fim:
+            try:
+                item = self.queue.get(timeout=self.flush_interval if batch else None)
+            except queue.Empty:
+                item = None
+            if item is _FIM:
+                fim = True
+            elif item is not None:
+                batch.append(item)
+                # Esvazia o que já estiver na fila até completar o lote
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _FIM:
+                        fim = True
+                        break
+                    batch.append(item)
+            if batch and (fim or item is None or len(batch) >= self.batch_size):
+                self._write(batch)
+                batch = []
+        try:
+            self.writer.close()
+        except Exception as e:
+            logger.error(f"Erro ao finalizar saída: {str(e)}")
+
+    def _write(self, batch):
+        records = [record for record, _ in batch]
+        try:
+            if self.tracer is not None:
+                with self.tracer.span('sink.write_batch', 'saida', registros=len(records)):
+                    self.writer.write_batch(records)
+            else:
+                self.writer.write_batch(records)
+            self.written += len(records)
+        except Exception as e:
+            self.failed += len(records)
+            logger.error(f"Erro ao gravar lote de {len(records)} registros: {str(e)}")
+            return
+        for _, ack in batch:
+            if ack is None:
+                continue
+            try:
+                ack()
+            except Exception as e:
+                logger.error(f"Erro ao confirmar registro gravado: {str(e)}")
+
+    def close(self, timeout=None):
+        """Sinaliza o fim, espera a fila ser descarregada e fecha o writer."""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(_FIM)
+        self._thread.join(timeout)
+        atexit.unregister(self.close)
+
+
+class TabularFileWriter:
+    """
+    Grava os lotes em CSV (append) e regenera o XLSX a cada `excel_every`
+    lotes e no fechamento, sem reler a planilha a cada gravação.
+    """
+    def __init__(self, csv_filename, excel_filename, headers, excel_every=10, snapshot_dir=None):
+        self.csv_filename = csv_filename
+        self.excel_filename = excel_filename
+        self.headers = headers
+        self.excel_every = excel_every
+        self.batches = 0
+        self.snapshot = None
+        if snapshot_dir:
+            from snapshot import SnapshotBuilder
+            self.snapshot = SnapshotBuilder(snapshot_dir, headers)
+
+    def write_batch(self, batch):
+        import pandas as pd
+        pd.DataFrame(batch, columns=self.headers).to_csv(
+            self.csv_filename,
+            mode='a',
+            header=not os.path.exists(self.csv_filename),
+            index=False
+        )
+        self.batches += 1
+        if self.snapshot is not None:
+            self.snapshot.add_batch(batch)
+        if self.excel_filename and self.batches % self.excel_every == 0:
+            self.write_excel()
+
+    def write_excel(self):
+        if os.path.exists(self.csv_filename):
+            import pandas as pd
+            pd.read_csv(self.csv_filename).to_excel(self.excel_filename, index=False)
+
+    def close(self):
+        if self.snapshot is not None:
+            self.snapshot.save(csv=self.csv_filename, xlsx=self.excel_filename)
+        if self.excel_filename:
+            self.write_excel()
@@ -0,0 +1,195 @@
+import os
+import json
+import shutil
+import logging
+from array import array
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+# Colunas numéricas de largura fixa (typecode do array, dtype do .npy)
+NUMERIC = {
+    'tabela_id': ('i', '<i4'),
+    'anomod': ('i', '<i4'),
+    'comb_cod': ('i', '<i4'),
+    'valor': ('d', '<f8'),
+    'consulta': ('q', '<i8'),  # microssegundos desde a época
+}
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _epoch_us(value):
+    # Horário local "ingênuo", do jeito que o crawler grava; sem fuso.
+    # 0 marca valor vazio ou inválido, que volta como ''
+    try:
+        return (datetime.fromisoformat(str(value)).replace(tzinfo=None) - _EPOCH) // _US
+    except ValueError:
+        return 0
+
+
+def _isoformat(values):
+    """Microssegundos -> texto igual ao datetime.isoformat() gravado pelo crawler."""
+    import numpy as np
+    import pandas as pd
+    values = np.asarray(values)
+    texto = pd.to_datetime(values, unit='us').strftime('%Y-%m-%dT%H:%M:%S.%f').to_numpy(dtype=object)
+    # isoformat() omite a fração quando os microssegundos são zero
+    inteiros = values % 1_000_000 == 0
+    texto[inteiros] = [t[:-7] for t in texto[inteiros]]
+    texto[values == 0] = ''
+    return texto
+
+
+class SnapshotBuilder:
+    """
+    Acumula os lotes de uma coleta em colunas compactas e grava, no fim, um
+    snapshot colunar: um .npy por coluna (numéricas em largura fixa, textos
+    como códigos int32) mais o dicionário de strings em JSON.
+
+    Se já existir um snapshot no caminho (coleta retomada nos mesmos
+    arquivos), os lotes novos são acrescentados a ele.
+    """
+    def __init__(self, path, headers):
+        self.path = path
+        self.headers = list(headers)
+        self.columns = {
+            name: array(NUMERIC[name][0]) if name in NUMERIC else array('i')
+            for name in self.headers
+        }
+        self.codes = {}
+        self.rows = 0
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            self._resume()
+
+    def _resume(self):
+        anterior = Snapshot.open(self.path)
+        if anterior.meta['columns'] != self.headers:
+            logger.warning(f"Snapshot {self.path} tem outras colunas; será substituído.")
+            return
+        self.codes = {value: code for code, value in enumerate(anterior.strings)}
+        for name, column in self.columns.items():
+            column.frombytes(anterior.columns[name].tobytes())
+        self.rows = len(anterior)
+
+    def _code(self, value):
+        value = '' if value is None else str(value)
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def add_batch(self, batch):
+        for record in batch:
+            for name, column in self.columns.items():
+                value = record.get(name)
+                if name == 'consulta':
+                    column.append(_epoch_us(value))
+                elif name == 'valor':
+                    column.append(_float(value))
+                elif name in NUMERIC:
+                    column.append(_int(value))
+                else:
+                    column.append(self._code(value))
+        self.rows += len(batch)
+
+    def save(self, **meta):
+        import numpy as np
+        tmp = f"{self.path}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, column in self.columns.items():
+            dtype = NUMERIC[name][1] if name in NUMERIC else '<i4'
+            np.save(os.path.join(tmp, f"{name}.npy"), np.frombuffer(column, dtype=dtype))
+        with open(os.path.join(tmp, 'strings.json'), 'w', encoding='utf-8') as f:
+            json.dump(list(self.codes), f, ensure_ascii=False)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'rows': self.rows,
+                'columns': self.headers,
+                'created': datetime.now().isoformat(),
+                **meta
+            }, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp, self.path)
+        logger.info(f"Snapshot com {self.rows} registros salvo em {self.path}")
+        return self.path
+
+
+class Snapshot:
+    """
+    Snapshot de uma coleta aberto por memory-map: as colunas não são lidas
+    nem copiadas até serem usadas. Textos viram Categorical sobre o
+    dicionário, reaproveitando os códigos sem montar uma string por linha.
+    """
+    def __init__(self, path):
+        import numpy as np
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, 'strings.json'), encoding='utf-8') as f:
+            self.strings = json.load(f)
+        self.columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+            for name in self.meta['columns']
+        }
+
+    @classmethod
+    def open(cls, path):
+        # Aceita o diretório do snapshot ou o meta.json dentro dele
+        if os.path.basename(path) == 'meta.json':
+            path = os.path.dirname(path)
+        return cls(path)
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def column(self, name):
+        import pandas as pd
+        values = self.columns[name]
+        if name == 'consulta':
+            return _isoformat(values)
+        if name in NUMERIC:
+            return values
+        return pd.Categorical.from_codes(values, categories=self.strings)
+
+    def to_frame(self, columns=None):
+        import pandas as pd
+        columns = columns or self.meta['columns']
+        return pd.DataFrame({name: self.column(name) for name in columns}, columns=columns)
+
+    def iter_batches(self, size=1000):
+        """Registros em lotes de dicts, no formato gravado pelo crawler."""
+        for start in range(0, len(self), size):
+            stop = min(start + size, len(self))
+            partes = {}
+            for name, values in self.columns.items():
+                chunk = values[start:stop].tolist()
+                if name == 'consulta':
+                    chunk = [(_EPOCH + v * _US).isoformat() if v else '' for v in chunk]
+                elif name not in NUMERIC:
+                    chunk = [self.strings[code] for code in chunk]
+                partes[name] = chunk
+            yield [dict(zip(partes, linha)) for linha in zip(*partes.values())]
+
+    def to_csv(self, filename):
+        self.to_frame().to_csv(filename, index=False)
+        return filename
+
+    def to_excel(self, filename):
+        self.to_frame().to_excel(filename, index=False)
+        return filename
@@ -0,0 +1,123 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+import contextlib
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer:
+    """
+    Registra spans (rate limiter, rede, decodificação JSON, extração, gravação)
+    e exporta no formato Chrome trace / Perfetto (chrome://tracing, ui.perfetto.dev).
+
+    Desabilitado, `span` devolve um contexto vazio e não custa nada além da chamada.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        self._origin = perf_counter()
+        self._lock = threading.Lock()
+
+    def _track(self):
+        # Cada tarefa asyncio ganha sua própria trilha, para que spans
+        # concorrentes na mesma thread não se sobreponham na visualização
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return f"{threading.current_thread().name}/{task.get_name()}"
+        return threading.current_thread().name
+
+    @contextlib.contextmanager
+    def _span(self, name, category, args):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': (start - self._origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': os.getpid(),
+                'tid': self._track(),
+            }
+            if args:
+                event['args'] = args
+            with self._lock:
+                self.events.append(event)
+
+    def span(self, name, category='crawler', **args):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._span(name, category, args)
+
+    def export(self, filename):
+        """Grava a linha do tempo em JSON. Trilhas textuais viram metadados de nome."""
+        with self._lock:
+            events = list(self.events)
+        tids = {}
+        for event in events:
+            event['tid'] = tids.setdefault(event['tid'], len(tids) + 1)
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+            for name, tid in tids.items()
+        ]
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f)
+        logger.info(f"Trace com {len(events)} spans salvo em {filename}")
+        return filename
+
+
+class Profiler:
+    """
+    Executa a coleta sob um profiler e salva o resultado ao lado dos arquivos
+    de saída. Modos: 'cprofile' (determinístico, biblioteca padrão) e
+    'pyinstrument' (amostragem, dependência opcional).
+    """
+    def __init__(self, mode=None):
+        self.mode = mode
+        self._profiler = None
+
+    def start(self):
+        if self.mode == 'cprofile':
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.mode == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler as SamplingProfiler
+            except ImportError:
+                logger.error("pyinstrument não instalado; profiling desabilitado.")
+                self.mode = None
+                return
+            # async_mode permite atribuir o tempo de await à corrotina que esperou
+            self._profiler = SamplingProfiler(async_mode='enabled')
+            self._profiler.start()
+        elif self.mode:
+            logger.error(f"Modo de profiling desconhecido: {self.mode}")
+            self.mode = None
+
+    def stop(self, basename):
+        """Para o profiler e salva em `basename` + extensão do modo. Retorna o arquivo."""
+        if self._profiler is None:
+            return None
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+            filename = f"{basename}.prof"
+            self._profiler.dump_stats(filename)
+        else:
+            self._profiler.stop()
+            filename = f"{basename}.html"
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write(self._profiler.output_html())
+        self._profiler = None
+        logger.info(f"Perfil salvo em {filename}")
+        return filename